@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+User = get_user_model()
+
+TOKEN_CACHE_KEY = 'auth_token:{}'
+# Хэш пароля для аутентификации по токену не нужен и в кэш не попадает.
+SNAPSHOT_EXCLUDE = ('password',)
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с временем жизни записей."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            self.items[key] = (value, monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+local_tokens = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE,
+                        settings.AUTH_TOKEN_CACHE_TTL)
+
+
+def user_snapshot(user):
+    """Значения полей пользователя, которые можно кэшировать.
+
+    Счетчики (editable=False) и поля из SNAPSHOT_EXCLUDE не
+    сохраняются: у восстановленного пользователя они остаются
+    отложенными, подгружаются при обращении и не перезаписываются
+    при user.save().
+    """
+    return {
+        field.attname: getattr(user, field.attname)
+        for field in User._meta.concrete_fields
+        if (field.editable or field.primary_key)
+        and field.attname not in SNAPSHOT_EXCLUDE}
+
+
+def user_from_snapshot(values):
+    return User.from_db(
+        router.db_for_read(User), list(values), list(values.values()))
+
+
+def invalidate_tokens(keys):
+    keys = list(keys)
+    for key in keys:
+        local_tokens.delete(key)
+    if settings.AUTH_TOKEN_SHARED_CACHE_TTL and keys:
+        cache.delete_many([TOKEN_CACHE_KEY.format(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication с кэшем пользователей по токену.
+
+    Сначала проверяется LRU-кэш процесса, затем, если задан
+    AUTH_TOKEN_SHARED_CACHE_TTL, общий кэш. Записи удаляются при
+    удалении токена (выход, смена пароля) и при изменении пользователя.
+    В остальных процессах локальная запись живет не дольше
+    AUTH_TOKEN_CACHE_TTL секунд.
+    """
+
+    def authenticate_credentials(self, key):
+        values = local_tokens.get(key)
+        shared_ttl = settings.AUTH_TOKEN_SHARED_CACHE_TTL
+        if values is None and shared_ttl:
+            values = cache.get(TOKEN_CACHE_KEY.format(key))
+            if values is not None:
+                local_tokens.set(key, values)
+        if values is not None:
+            user = user_from_snapshot(values)
+            return user, Token(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        values = user_snapshot(user)
+        local_tokens.set(key, values)
+        if shared_ttl:
+            cache.set(TOKEN_CACHE_KEY.format(key), values, shared_ttl)
+        return user, token
@@ -0,0 +1,122 @@
+from hashlib import md5
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.core.cache import cache
+from foodgram.constants import RECIPE_CACHE_TIMEOUT
+
+from .viewer import ViewerState
+
+RECIPES_GENERATION_KEY = 'recipes_generation'
+POPULARITY_GENERATION_KEY = 'popularity_generation'
+VIEWER_GENERATION_KEY = 'viewer_generation:{}'
+PERSONAL_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def bump_generation(key):
+    cache.set(key, uuid4().hex, None)
+
+
+def get_generations(keys):
+    """Текущие поколения; вытесненные из кэша заменяются новыми.
+
+    Поколения -- случайные строки, а не счетчики: после вытеснения
+    ключа новое поколение не совпадет ни с одним из прежних, и
+    устаревшие страницы не будут найдены.
+    """
+    generations = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return generations
+
+
+def bump_recipes_generation():
+    bump_generation(RECIPES_GENERATION_KEY)
+
+
+def bump_popularity_generation():
+    bump_generation(POPULARITY_GENERATION_KEY)
+
+
+def bump_viewer_generation(user_id):
+    bump_generation(VIEWER_GENERATION_KEY.format(user_id))
+
+
+class RecipeListCache:
+    """Кэш страниц списка рецептов.
+
+    Общая для всех часть ответа кэшируется без признаков
+    is_favorited, is_in_shopping_cart и is_subscribed, они
+    накладываются поверх через ViewerState только для id страницы.
+    Ключи содержат поколения, которые меняются при изменении рецептов,
+    для сортировки по популярности -- и при изменении избранного, а
+    для страниц с личными фильтрами -- при изменении связей
+    пользователя.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.user = request.user
+        params = request.query_params
+        self.personal = self.user.is_authenticated and any(
+            params.get(name) for name in PERSONAL_FILTERS)
+        self.viewer_key = (VIEWER_GENERATION_KEY.format(self.user.id)
+                           if self.personal else None)
+        self.popular = params.get('ordering') == 'popular'
+        query = urlencode(sorted(
+            (name, value) for name in params
+            for value in params.getlist(name)))
+        self.query_hash = md5(
+            f'{request.get_host()}?{query}'.encode()).hexdigest()
+
+    def _generations(self):
+        keys = [RECIPES_GENERATION_KEY, POPULARITY_GENERATION_KEY]
+        if self.viewer_key:
+            keys.append(self.viewer_key)
+        generations = get_generations(keys)
+        recipes_generation = generations[RECIPES_GENERATION_KEY]
+        if self.popular:
+            recipes_generation = (
+                f'{recipes_generation}.'
+                f'{generations[POPULARITY_GENERATION_KEY]}')
+        return recipes_generation, generations.get(self.viewer_key)
+
+    def _page_key(self, recipes_generation, viewer_generation):
+        if self.personal:
+            return (f'recipes:{recipes_generation}:{self.user.id}:'
+                    f'{viewer_generation}:{self.query_hash}')
+        return f'recipes:{recipes_generation}:{self.query_hash}'
+
+    def _apply_viewer_state(self, data):
+        if not self.user.is_authenticated:
+            return data
+        results = data['results']
+        state = ViewerState.for_request(self.request)
+        recipe_ids = [recipe['id'] for recipe in results]
+        state.expect('favorites', recipe_ids)
+        state.expect('shopping_cart', recipe_ids)
+        state.expect('subscriptions',
+                     [recipe['author']['id'] for recipe in results])
+        for recipe in results:
+            recipe['is_favorited'] = state.has('favorites', recipe['id'])
+            recipe['is_in_shopping_cart'] = state.has(
+                'shopping_cart', recipe['id'])
+            recipe['author']['is_subscribed'] = state.has(
+                'subscriptions', recipe['author']['id'])
+        return data
+
+    def get_or_render(self, render):
+        """Возвращает страницу из кэша или строит ее через render().
+
+        render() должен вернуть данные страницы для анонимного
+        пользователя.
+        """
+        recipes_generation, viewer_generation = self._generations()
+        key = self._page_key(recipes_generation, viewer_generation)
+        data = cache.get(key)
+        if data is None:
+            data = render()
+            cache.set(key, data, RECIPE_CACHE_TIMEOUT)
+        return self._apply_viewer_state(data)
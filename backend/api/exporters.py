@@ -0,0 +1,105 @@
+import csv
+import json
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 500
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class ShoppingListExporter:
+    content_type = 'text/plain'
+    extension = 'txt'
+
+    def __init__(self, user):
+        self.user = user
+        self.today = datetime.today()
+
+    def get_ingredients(self):
+        return self.user.shopping_list.values(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def header(self):
+        return (f'Список покупок для: {self.user.get_full_name()}\n\n'
+                f'Дата: {self.today:%Y-%m-%d}\n\n')
+
+    def row(self, ingredient, first):
+        line = (f'- {ingredient["ingredient__name"]} '
+                f'({ingredient["ingredient__measurement_unit"]})'
+                f' - {ingredient["amount"]}')
+        return line if first else '\n' + line
+
+    def footer(self):
+        return f'\n\nFoodgram ({self.today:%Y})'
+
+    def stream(self):
+        yield self.header()
+        first = True
+        for ingredient in self.get_ingredients():
+            yield self.row(ingredient, first)
+            first = False
+        yield self.footer()
+
+    def get_response(self):
+        filename = f'{self.user.username}_shopping_list.{self.extension}'
+        response = StreamingHttpResponse(
+            self.stream(), content_type=self.content_type)
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
+
+
+class CSVShoppingListExporter(ShoppingListExporter):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def __init__(self, user):
+        super().__init__(user)
+        self.writer = csv.writer(Echo())
+
+    def header(self):
+        return self.writer.writerow(('name', 'measurement_unit', 'amount'))
+
+    def row(self, ingredient, first):
+        return self.writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['amount'],
+        ))
+
+    def footer(self):
+        return ''
+
+
+class JSONShoppingListExporter(ShoppingListExporter):
+    content_type = 'application/json'
+    extension = 'json'
+
+    def header(self):
+        username = json.dumps(self.user.username, ensure_ascii=False)
+        return (f'{{"user": {username}, '
+                f'"date": "{self.today:%Y-%m-%d}", "ingredients": [')
+
+    def row(self, ingredient, first):
+        return ('' if first else ', ') + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['amount'],
+        }, ensure_ascii=False)
+
+    def footer(self):
+        return ']}'
+
+
+EXPORTERS = {
+    exporter.extension: exporter
+    for exporter in (ShoppingListExporter, CSVShoppingListExporter,
+                     JSONShoppingListExporter)
+}
@@ -0,0 +1,17 @@
+from pathlib import PurePath
+from uuid import uuid4
+
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import ImageField
+
+
+class RecipeImageField(Base64ImageField):
+    """Изображение в base64 или файлом из multipart/form-data."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            image = ImageField.to_internal_value(self, data)
+            image.name = f'{uuid4()}{PurePath(image.name).suffix.lower()}'
+            return image
+        return super().to_internal_value(data)
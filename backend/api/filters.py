@@ -1,24 +1,46 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Recipe, Ingredient
+from recipes.fulltext import search_recipes
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart
+from recipes.tags import tag_choices, tag_ids_by_slug
 
 
 class RecipeFilter(FilterSet):
     is_favorited = filters.CharFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.CharFilter(
         method='get_is_in_shopping_cart')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='get_tags')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='get_ordering')
 
     def get_is_favorited(self, recipes, name, value):
         if value and self.request.user.is_authenticated:
-            return recipes.filter(in_favorites__user=self.request.user)
+            return recipes.filter(Exists(Favorite.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         return recipes
 
     def get_is_in_shopping_cart(self, recipes, name, value):
         if value and self.request.user.is_authenticated:
-            return recipes.filter(in_shopping_cart__user=self.request.user)
+            return recipes.filter(Exists(ShoppingCart.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk'))))
         return recipes
 
+    def get_tags(self, recipes, name, slugs):
+        tags = tag_ids_by_slug()
+        return recipes.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tags[slug] for slug in slugs if slug in tags])))
+
+    def get_search(self, recipes, name, value):
+        return search_recipes(recipes, value)
+
+    def get_ordering(self, recipes, name, value):
+        return recipes.order_by('-favorites_count', '-pub_date')
+
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
@@ -0,0 +1,283 @@
+import base64
+import json
+import random
+from io import BytesIO
+from math import ceil
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from recipes.images import image_files, wait_for_renditions
+from recipes.management.commands.seed_data import PREFIX
+from recipes.models import Ingredient, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.cache import bump_recipes_generation
+
+User = get_user_model()
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[max(0, ceil(share * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Измеряет задержки, пропускную способность и число '
+            'SQL-запросов API на данных seed_data')
+
+    scenarios = (
+        'recipes_by_tags',
+        'recipes_by_tags_cached',
+        'ingredient_autocomplete',
+        'recipe_search',
+        'pantry',
+        'subscriptions',
+        'download_shopping_cart',
+        'recipe_create',
+        'recipe_update',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--scenario', action='append', choices=self.scenarios,
+            help='Запустить только указанные сценарии')
+        parser.add_argument(
+            '--baseline', type=Path,
+            help='Файл с эталонными результатами для сравнения')
+        parser.add_argument(
+            '--save-baseline', type=Path,
+            help='Сохранить результаты как эталонные')
+        parser.add_argument(
+            '--latency-tolerance', type=float, default=0.5,
+            help='Допустимый рост p50/p99 относительно эталона, доля; '
+                 'отрицательное значение отключает проверку задержек')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def setup(self):
+        viewer = User.objects.filter(
+            username__startswith=f'{PREFIX}_',
+            shopping_cart__isnull=False,
+            subscriptions_as_user__isnull=False,
+        ).order_by('pk').first()
+        if viewer is None:
+            raise CommandError('Нет данных, сначала выполните seed_data')
+        token, _ = Token.objects.get_or_create(user=viewer)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.anonymous = APIClient()
+        self.tags = list(Tag.objects.filter(
+            slug__startswith=f'{PREFIX}-').values_list('id', 'slug'))
+        names = Ingredient.objects.values_list('name', flat=True)[:500]
+        self.prefixes = sorted({name[:3] for name in names if name})
+        self.ingredients = list(
+            Ingredient.objects.values_list('id', flat=True)[:500])
+        buffer = BytesIO()
+        Image.new('RGB', (640, 480), 'green').save(buffer, 'JPEG')
+        self.image = ('data:image/jpeg;base64,'
+                      + base64.b64encode(buffer.getvalue()).decode())
+        self.updated_recipe = None
+        self.created_recipes = []
+        self.replaced_images = []
+
+    def cleanup(self):
+        """Удаляет созданные замерами рецепты вместе с изображениями."""
+        wait_for_renditions()
+        recipes = Recipe.objects.filter(pk__in=self.created_recipes)
+        images = [*recipes.values_list('image', flat=True),
+                  *self.replaced_images]
+        recipes.delete()
+        for image in filter(None, images):
+            for name in image_files(image):
+                default_storage.delete(name)
+
+    def recipe_payload(self, ingredients=None, tags=None):
+        if ingredients is None:
+            ingredients = self.rng.sample(
+                self.ingredients, min(10, len(self.ingredients)))
+        if tags is None:
+            tags = [tag for tag, _ in self.rng.sample(
+                self.tags, min(2, len(self.tags)))]
+        return {
+            'tags': tags,
+            'ingredients': [
+                {'id': ingredient, 'amount': 10}
+                for ingredient in ingredients],
+            'name': 'Рецепт из нагрузочного теста',
+            'image': self.image,
+            'text': 'Описание',
+            'cooking_time': 30,
+        }
+
+    def recipes_by_tags(self, index):
+        slugs = [slug for _, slug in self.rng.sample(
+            self.tags, self.rng.randint(1, min(3, len(self.tags))))]
+        query = '&'.join(f'tags={slug}' for slug in slugs)
+        return dict(
+            prepare=bump_recipes_generation, client=self.anonymous,
+            method='get', url=f'/api/recipes/?{query}&page={index % 5 + 1}')
+
+    def recipes_by_tags_cached(self, index):
+        _, slug = self.tags[index % len(self.tags)]
+        return dict(client=self.anonymous, method='get',
+                    url=f'/api/recipes/?tags={slug}')
+
+    def ingredient_autocomplete(self, index):
+        prefix = self.rng.choice(self.prefixes)
+        return dict(client=self.anonymous, method='get',
+                    url=f'/api/ingredients/?name={prefix[:index % 3 + 1]}')
+
+    def recipe_search(self, index):
+        query = urlencode({'search': self.rng.choice(self.prefixes)})
+        return dict(
+            prepare=bump_recipes_generation, client=self.anonymous,
+            method='get', url=f'/api/recipes/?{query}')
+
+    def pantry(self, index):
+        ingredients = self.rng.sample(
+            self.ingredients, min(20, len(self.ingredients)))
+        query = urlencode({'ingredients': ingredients}, doseq=True)
+        return dict(client=self.client, method='get',
+                    url=f'/api/recipes/pantry/?{query}&max_missing=3')
+
+    def subscriptions(self, index):
+        return dict(client=self.client, method='get',
+                    url='/api/users/subscriptions/?recipes_limit=3')
+
+    def download_shopping_cart(self, index):
+        extension = ('txt', 'csv', 'json')[index % 3]
+        return dict(
+            client=self.client, method='get',
+            url=f'/api/recipes/download_shopping_cart/?type={extension}')
+
+    def recipe_create(self, index):
+        return dict(client=self.client, method='post', url='/api/recipes/',
+                    data=self.recipe_payload())
+
+    def recipe_update(self, index):
+        """Попеременно меняет все ингредиенты и теги одного рецепта."""
+        payloads = [
+            self.recipe_payload(
+                self.ingredients[offset * 10:offset * 10 + 10],
+                [tag for tag, _ in self.tags[offset:offset + 1]])
+            for offset in (0, 1)]
+        if self.updated_recipe is None:
+            response = self.request(dict(
+                client=self.client, method='post', url='/api/recipes/',
+                data=payloads[1]))
+            self.updated_recipe = response.json()['id']
+        # Правка заменяет изображение, а старые файлы остаются на диске.
+        self.replaced_images.append(Recipe.objects.values_list(
+            'image', flat=True).get(pk=self.updated_recipe))
+        return dict(client=self.client, method='patch',
+                    url=f'/api/recipes/{self.updated_recipe}/',
+                    data=payloads[index % 2])
+
+    def request(self, spec):
+        kwargs = {}
+        if 'data' in spec:
+            kwargs = {'data': spec['data'], 'format': 'json'}
+        response = getattr(spec['client'], spec['method'])(
+            spec['url'], **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{spec["method"].upper()} {spec["url"]}: '
+                f'{response.status_code} {response.content[:500]}')
+        if spec['method'] == 'post' and spec['url'] == '/api/recipes/':
+            self.created_recipes.append(response.data['id'])
+        return response
+
+    def run(self, scenario, iterations, warmup):
+        for index in range(warmup):
+            self.request(scenario(index))
+        latencies = []
+        queries = []
+        elapsed = 0
+        for index in range(iterations):
+            spec = scenario(index)
+            if 'prepare' in spec:
+                spec['prepare']()
+            with CaptureQueriesContext(connection) as context:
+                started = perf_counter()
+                self.request(spec)
+                latency = perf_counter() - started
+            elapsed += latency
+            latencies.append(latency * 1000)
+            queries.append(len(context.captured_queries))
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'rps': round(iterations / elapsed, 1),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, baseline, tolerance):
+        problems = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            if result['queries'] > expected['queries']:
+                problems.append(
+                    f'{name}: SQL-запросов {result["queries"]}, '
+                    f'в эталоне {expected["queries"]}')
+            if tolerance < 0:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                limit = expected[metric] * (1 + tolerance)
+                if result[metric] > limit:
+                    problems.append(
+                        f'{name}: {metric} {result[metric]}, '
+                        f'в эталоне {expected[metric]}')
+        return problems
+
+    def measure(self, name, iterations, options):
+        warmup = options['warmup']
+        if name == 'recipes_by_tags_cached':
+            # Страница каждого тега должна попасть в кэш до замеров.
+            warmup = max(warmup, len(self.tags))
+        result = self.run(getattr(self, name), iterations, warmup)
+        self.stdout.write(
+            f'{name:<26} p50 {result["p50_ms"]:>8} мс  '
+            f'p99 {result["p99_ms"]:>8} мс  '
+            f'{result["rps"]:>8} запр/с  '
+            f'SQL {result["queries"]:>3}')
+        return result
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        iterations = max(1, options['iterations'])
+        results = {}
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        with override_settings(ALLOWED_HOSTS=hosts):
+            self.setup()
+            try:
+                for name in options['scenario'] or self.scenarios:
+                    results[name] = self.measure(name, iterations, options)
+            finally:
+                self.cleanup()
+        if options['save_baseline']:
+            options['save_baseline'].write_text(
+                json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Эталон сохранен в {options["save_baseline"]}'))
+        if options['baseline']:
+            problems = self.compare(
+                results, json.loads(options['baseline'].read_text()),
+                options['latency_tolerance'])
+            if problems:
+                raise CommandError(
+                    'Результаты хуже эталона:\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -1,8 +1,153 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from foodgram.constants import PAG_LIMIT
 
 
-class CustomPagination(PageNumberPagination):
+def estimate_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class PagePagination(PageNumberPagination):
     page_size = PAG_LIMIT
     page_size_query_param = 'limit'
+
+
+class CustomPagination(PagePagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    По умолчанию работают параметры page и limit. Если в запросе есть
+    параметр cursor (для первой страницы -- пустой), страницы выбираются
+    по ключу из полей сортировки и первичного ключа, без OFFSET и
+    COUNT(*). С параметром count=estimate в ответ добавляется
+    оценка количества записей.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.ordering = self.get_ordering(queryset)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = estimate_count(queryset)
+        page_size = self.get_page_size(request)
+        backwards, values = self.decode_cursor(
+            queryset, request.query_params[self.cursor_query_param])
+        if values is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(values, backwards))
+        ordering = [
+            (name, descending != backwards)
+            for name, descending in self.ordering]
+        queryset = queryset.order_by(*(
+            f'-{name}' if descending else name
+            for name, descending in ordering))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if backwards:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.results = results
+        return results
+
+    def get_ordering(self, queryset):
+        ordering = [
+            (name.lstrip('-'), name.startswith('-'))
+            for name in (queryset.query.order_by
+                         or queryset.model._meta.ordering)]
+        if not any(name in ('pk', 'id') for name, _ in ordering):
+            ordering.append(('pk', ordering[-1][1] if ordering else False))
+        return ordering
+
+    def keyset_filter(self, values, backwards):
+        condition = Q()
+        for index, (name, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != backwards else 'gt'
+            equal = {
+                previous: values[position]
+                for position, (previous, _) in enumerate(
+                    self.ordering[:index])}
+            condition |= Q(**equal, **{f'{name}__{lookup}': values[index]})
+        return condition
+
+    def encode_cursor(self, obj, backwards):
+        values = []
+        for name, _ in self.ordering:
+            value = getattr(obj, name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            values.append(value)
+        token = json.dumps({'b': backwards, 'v': values}).encode()
+        return urlsafe_b64encode(token).decode()
+
+    def get_field(self, queryset, name):
+        """Поле модели или аннотации, по которому идет сортировка."""
+        if name == 'pk':
+            return queryset.model._meta.pk
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, queryset, token):
+        if not token:
+            return False, None
+        try:
+            cursor = json.loads(urlsafe_b64decode(token.encode()))
+            values = [
+                self.get_field(queryset, name).to_python(value)
+                for (name, _), value in zip(self.ordering, cursor['v'])]
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return bool(cursor['b']), values
+        except (KeyError, TypeError, ValueError, ValidationError,
+                FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_cursor_link(self, obj, backwards):
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(obj, backwards))
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = (
+            self.get_cursor_link(self.results[-1], False)
+            if self.has_next and self.results else None)
+        response['previous'] = (
+            self.get_cursor_link(self.results[0], True)
+            if self.has_previous and self.results else None)
+        response['results'] = data
+        return Response(response)
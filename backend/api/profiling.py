@@ -0,0 +1,268 @@
+import logging
+import random
+from collections import Counter
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+MAX_TRACED_QUERIES = 500
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class ViewMetrics:
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.db_seconds = 0
+        self.serialization_seconds = 0
+        self.response_bytes = 0
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.queries_per_request = Histogram(QUERY_BUCKETS)
+
+
+class MetricsRegistry:
+    """Накопленные метрики запросов текущего процесса."""
+
+    def __init__(self):
+        self.views = {}
+        self.lock = Lock()
+
+    def observe(self, profile, duration, response_bytes):
+        with self.lock:
+            metrics = self.views.setdefault(
+                (profile.view, profile.method), ViewMetrics())
+            metrics.requests += 1
+            metrics.queries += profile.queries
+            metrics.db_seconds += profile.db_seconds
+            metrics.serialization_seconds += profile.serialization_seconds
+            metrics.response_bytes += response_bytes
+            metrics.duration.observe(duration)
+            metrics.queries_per_request.observe(profile.queries)
+
+    def counter_lines(self, name, help_text, attribute):
+        yield f'# HELP {name} {help_text}'
+        yield f'# TYPE {name} counter'
+        for (view, method), metrics in self.views.items():
+            yield (f'{name}{{view="{view}",method="{method}"}} '
+                   f'{getattr(metrics, attribute)}')
+
+    def histogram_lines(self, name, help_text, attribute):
+        yield f'# HELP {name} {help_text}'
+        yield f'# TYPE {name} histogram'
+        for (view, method), metrics in self.views.items():
+            histogram = getattr(metrics, attribute)
+            labels = f'view="{view}",method="{method}"'
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+            yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+            yield f'{name}_sum{{{labels}}} {histogram.sum}'
+            yield f'{name}_count{{{labels}}} {histogram.count}'
+
+    def render(self):
+        with self.lock:
+            lines = [
+                *self.counter_lines(
+                    'foodgram_requests_total',
+                    'Количество запросов.', 'requests'),
+                *self.counter_lines(
+                    'foodgram_db_queries_total',
+                    'Количество SQL-запросов.', 'queries'),
+                *self.counter_lines(
+                    'foodgram_db_seconds_total',
+                    'Время выполнения SQL-запросов.', 'db_seconds'),
+                *self.counter_lines(
+                    'foodgram_serialization_seconds_total',
+                    'Время сериализации и рендеринга ответа.',
+                    'serialization_seconds'),
+                *self.counter_lines(
+                    'foodgram_response_bytes_total',
+                    'Размер ответов.', 'response_bytes'),
+                *self.histogram_lines(
+                    'foodgram_request_duration_seconds',
+                    'Длительность обработки запроса.', 'duration'),
+                *self.histogram_lines(
+                    'foodgram_db_queries_per_request',
+                    'Количество SQL-запросов на запрос.',
+                    'queries_per_request'),
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = MetricsRegistry()
+
+
+class RequestProfile:
+    """Счетчики одного запроса; подключается через execute_wrapper."""
+
+    def __init__(self, method):
+        self.method = method
+        self.view = 'unmatched'
+        self.queries = 0
+        self.db_seconds = 0
+        self.serialization_seconds = 0
+        self.trace = []
+        self.handler_mark = None
+        self.render_started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            self.queries += 1
+            self.db_seconds += duration
+            if len(self.trace) < MAX_TRACED_QUERIES:
+                self.trace.append((sql, duration))
+
+    def mark(self):
+        return perf_counter(), self.db_seconds
+
+    def add_python_time(self, since):
+        started, db_seconds = since
+        self.serialization_seconds += (
+            perf_counter() - started - (self.db_seconds - db_seconds))
+
+    def rendered(self, response):
+        if self.render_started is not None:
+            self.add_python_time(self.render_started)
+        return response
+
+
+def view_name(request, view_func):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        match = request.resolver_match
+        return match.view_name if match else 'unmatched'
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+def response_size(response):
+    if response.streaming:
+        return 0
+    return len(response.content)
+
+
+class ProfiledViewMixin:
+    """Хук DRF для профилировщика запросов.
+
+    Время работы обработчика без SQL-запросов (в основном это
+    сериализация) добавляется к времени сериализации запроса.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        profile = getattr(request._request, 'profile', None)
+        if profile is not None:
+            profile.handler_mark = profile.mark()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        profile = getattr(request._request, 'profile', None)
+        if profile is not None and profile.handler_mark is not None:
+            profile.add_python_time(profile.handler_mark)
+            profile.handler_mark = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class QueryProfilerMiddleware:
+    """Считает SQL-запросы, время БД, сериализации и размер ответа.
+
+    Метрики накапливаются по представлениям и отдаются в формате
+    Prometheus. Если QUERY_PROFILER_SERVER_TIMING включен, те же
+    значения добавляются в заголовок Server-Timing. Для запросов,
+    превысивших пороги QUERY_PROFILER_SLOW_MS или
+    QUERY_PROFILER_SLOW_QUERIES, с вероятностью
+    QUERY_PROFILER_TRACE_RATE пишется трасса SQL-запросов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_PROFILER:
+            return self.get_response(request)
+        profile = RequestProfile(request.method)
+        request.profile = profile
+        started = perf_counter()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        duration = perf_counter() - started
+        registry.observe(profile, duration, response_size(response))
+        if settings.QUERY_PROFILER_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={profile.db_seconds * 1000:.1f};'
+                f'desc="{profile.queries} queries", '
+                f'ser;dur={profile.serialization_seconds * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}')
+        if self.is_slow(profile, duration) and (
+                random.random() < settings.QUERY_PROFILER_TRACE_RATE):
+            self.log_trace(request, profile, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.view = view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile.render_started = profile.mark()
+            response.add_post_render_callback(profile.rendered)
+        return response
+
+    def is_slow(self, profile, duration):
+        return (duration * 1000 >= settings.QUERY_PROFILER_SLOW_MS
+                or profile.queries >= settings.QUERY_PROFILER_SLOW_QUERIES)
+
+    def log_trace(self, request, profile, duration):
+        repeated = Counter(sql for sql, _ in profile.trace).most_common(5)
+        slowest = sorted(profile.trace, key=lambda item: -item[1])[:5]
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, SQL-запросов: %d, '
+            'время БД: %.0f мс\nЧаще всего:\n%s\nДольше всего:\n%s',
+            request.method, request.get_full_path(), profile.view,
+            duration * 1000, profile.queries, profile.db_seconds * 1000,
+            '\n'.join(f'  {count} x {sql}' for sql, count in repeated),
+            '\n'.join(f'  {seconds * 1000:.1f} мс {sql}'
+                      for sql, seconds in slowest))
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    authorized = (
+        token and request.headers.get('Authorization') == f'Bearer {token}'
+        or request.user.is_staff)
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -1,27 +1,55 @@
+from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import (Ingredient, Recipe, RecipeIngredient,
-                            Tag, Favorite, ShoppingCart)
-from rest_framework.fields import (ReadOnlyField,
-                                   SerializerMethodField)
-from rest_framework.relations import PrimaryKeyRelatedField
-from rest_framework.serializers import ModelSerializer, ValidationError
+from foodgram.constants import BULK_RELATIONS_LIMIT, PANTRY_INGREDIENTS_LIMIT
+from recipes import fulltext, shopping_list
+from recipes.images import rendition_urls, schedule_renditions
+from recipes.models import (Ingredient, ImageUpload, Recipe,
+                            RecipeIngredient, Tag)
+from rest_framework.fields import (FloatField, IntegerField, ListField,
+                                   ReadOnlyField, SerializerMethodField,
+                                   UUIDField)
+from rest_framework.serializers import (ListSerializer, ModelSerializer,
+                                        Serializer, ValidationError)
 
 from users.models import User, Subscription
 
+from .fields import RecipeImageField
+from .viewer import ViewerState
 
-class CustomUserSerializer(ModelSerializer):
+
+class ViewerListSerializer(ListSerializer):
+    """Передает id объектов страницы в ViewerState до сериализации."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, Manager) else data)
+        self.child.expect_viewer_state(items)
+        return super().to_representation(items)
+
+
+class ViewerStateMixin:
+
+    @property
+    def viewer_state(self):
+        return ViewerState.for_request(self.context.get('request'))
+
+
+class CustomUserSerializer(ViewerStateMixin, ModelSerializer):
     is_subscribed = SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username',
                   'first_name', 'last_name', 'is_subscribed')
+        list_serializer_class = ViewerListSerializer
+
+    def expect_viewer_state(self, users):
+        self.viewer_state.expect('subscriptions', [user.pk for user in users])
 
     def get_is_subscribed(self, author):
-        user = self.context.get('request').user
-        return (user is not None
-                and user.is_authenticated
-                and user.subscriptions_as_user.filter(author=author).exists())
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        return self.viewer_state.has('subscriptions', author.pk)
 
 
 class IngredientSerializer(ModelSerializer):
@@ -37,21 +65,60 @@ class TagSerializer(ModelSerializer):
 
 
 class CreateIngredientSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(queryset=Ingredient.objects.all(),
-                                source='ingredient.id')
+    id = IntegerField(source='ingredient_id')
 
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'amount')
 
 
+def add_id(ids, value):
+    """Добавляет id, приведенный так же, как это сделает IntegerField."""
+    try:
+        ids.add(IntegerField().to_internal_value(value))
+    except ValidationError:
+        pass
+
+
+def referenced_ids(recipes):
+    """Собирает id тегов и ингредиентов из необработанных данных рецептов."""
+    tags, ingredients = set(), set()
+    for recipe in recipes:
+        if not isinstance(recipe, dict):
+            continue
+        tag_ids = recipe.get('tags') or ()
+        for tag in tag_ids if isinstance(tag_ids, list) else ():
+            add_id(tags, tag)
+        ingredient_rows = recipe.get('ingredients') or ()
+        if not isinstance(ingredient_rows, list):
+            continue
+        for ingredient in ingredient_rows:
+            if isinstance(ingredient, dict):
+                add_id(ingredients, ingredient.get('id'))
+    return {Tag: tags, Ingredient: ingredients}
+
+
+class RecipeListSerializer(ListSerializer):
+    """Проверяет сразу несколько рецептов.
+
+    Существующие теги и ингредиенты всех рецептов загружаются заранее,
+    одним запросом на модель, и проверки отдельных рецептов берут их
+    из контекста.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.context['known_ids'] = {
+                model: set(model.objects.in_bulk(ids))
+                for model, ids in referenced_ids(data).items()}
+        return super().to_internal_value(data)
+
+
 class RecipeWriteSerializer(ModelSerializer):
-    tags = PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-    )
+    tags = ListField(child=IntegerField())
     ingredients = CreateIngredientSerializer(many=True)
-    image = Base64ImageField(required=True)
+    image = RecipeImageField(required=False)
+    image_token = UUIDField(write_only=True, required=False)
 
     class Meta:
         model = Recipe
@@ -60,10 +127,12 @@ class RecipeWriteSerializer(ModelSerializer):
             'ingredients',
             'name',
             'image',
+            'image_token',
             'text',
             'cooking_time',
         )
         read_only_fields = ('author',)
+        list_serializer_class = RecipeListSerializer
 
     def not_unique_items_validation(self, items, message):
         s_items = set(items)
@@ -72,6 +141,25 @@ class RecipeWriteSerializer(ModelSerializer):
                 f'Нельзя добавить одни и те же {message}')
         return items
 
+    def missing_ids(self, model, ids):
+        known = self.context.get('known_ids', {}).get(model)
+        if known is None:
+            known = set(model.objects.in_bulk(ids))
+        return sorted(set(ids) - known)
+
+    def validate_references(self, tags, ingredients):
+        errors = {}
+        missing = self.missing_ids(Tag, tags)
+        if missing:
+            errors['tags'] = [
+                f'Теги не найдены: {", ".join(map(str, missing))}']
+        missing = self.missing_ids(Ingredient, ingredients)
+        if missing:
+            errors['ingredients'] = [
+                f'Ингредиенты не найдены: {", ".join(map(str, missing))}']
+        if errors:
+            raise ValidationError(errors)
+
     def validate(self, data):
         tags = data.get('tags')
         if not tags:
@@ -80,46 +168,111 @@ class RecipeWriteSerializer(ModelSerializer):
         ingredients = data.get('ingredients')
         if not ingredients:
             raise ValidationError('нет ингредиентов')
-        image = data.get('image')
+        image = data.get('image') or data.get('image_token')
         if not image:
             raise ValidationError('нет фотографии')
-        self.not_unique_items_validation(
-            [ingredient['ingredient']['id'] for ingredient in ingredients],
-            'ингридиенты')
+        ingredient_ids = [
+            ingredient['ingredient_id'] for ingredient in ingredients]
+        self.not_unique_items_validation(ingredient_ids, 'ингридиенты')
+        self.validate_references(tags, ingredient_ids)
         return data
 
+    def validate_image_token(self, token):
+        upload = ImageUpload.objects.filter(
+            token=token, user=self.context['request'].user).first()
+        if upload is None:
+            raise ValidationError('Загруженное изображение не найдено')
+        return upload
+
+    def use_image_upload(self, validated_data):
+        upload = validated_data.pop('image_token', None)
+        if upload is not None:
+            validated_data['image'] = upload.image.name
+            upload.delete()
+
     def create_ingredients(self, ingredients, recipe):
+        if not ingredients:
+            return
         RecipeIngredient.objects.bulk_create(
             [RecipeIngredient(
-                ingredient=ingredient['ingredient']['id'],
+                ingredient_id=ingredient['ingredient_id'],
                 recipe=recipe,
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
 
+    @transaction.atomic
     def create(self, validated_data):
+        self.use_image_upload(validated_data)
         tags = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients_data, recipe)
+        fulltext.index_recipes((recipe.id,))
+        transaction.on_commit(lambda: schedule_renditions(recipe))
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        current = {
+            row.ingredient_id: row
+            for row in RecipeIngredient.objects.filter(recipe=recipe)}
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in current.items()}
+        new_amounts = {
+            ingredient['ingredient_id']: ingredient['amount']
+            for ingredient in ingredients}
+        removed = [row.id for ingredient_id, row in current.items()
+                   if ingredient_id not in new_amounts]
+        if removed:
+            RecipeIngredient.objects.filter(id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients(
+            [ingredient for ingredient in ingredients
+             if ingredient['ingredient_id'] not in current],
+            recipe)
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        tags_data = validated_data.pop('tags')
-        instance.tags.set(tags_data)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
+        self.use_image_upload(validated_data)
+        instance.tags.set(validated_data.pop('tags'))
+        shopping_list.change_recipe(instance.id, *self.update_ingredients(
+            validated_data.pop('ingredients'), instance))
+        if 'image' in validated_data:
+            validated_data['image_renditions'] = {}
+            transaction.on_commit(lambda: schedule_renditions(instance))
         return super().update(instance, validated_data)
 
     def to_representation(self, recipe):
+        prefetch_related_objects(
+            [recipe], 'tags', Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')))
         return RecipeReadSerializer(
             recipe,
             context={'request': self.context.get('request')},
         ).data
 
 
+class ImageUploadSerializer(ModelSerializer):
+    image = RecipeImageField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ('token', 'image')
+        read_only_fields = ('token',)
+
+
 class IngredientAmountSerializer(ModelSerializer):
     id = ReadOnlyField(source='ingredient.id')
     name = ReadOnlyField(source='ingredient.name')
@@ -131,12 +284,13 @@ class IngredientAmountSerializer(ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeReadSerializer(ModelSerializer):
+class RecipeReadSerializer(ViewerStateMixin, ModelSerializer):
     tags = TagSerializer(many=True)
     author = CustomUserSerializer(read_only=True)
     image = Base64ImageField()
     ingredients = IngredientAmountSerializer(
         many=True, source='recipeingredients')
+    images = SerializerMethodField()
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
 
@@ -148,32 +302,66 @@ class RecipeReadSerializer(ModelSerializer):
             'author',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
             'ingredients',
             'is_favorited',
             'is_in_shopping_cart'
         )
+        list_serializer_class = ViewerListSerializer
+
+    def expect_viewer_state(self, recipes):
+        recipe_ids = [recipe.pk for recipe in recipes]
+        self.viewer_state.expect('favorites', recipe_ids)
+        self.viewer_state.expect('shopping_cart', recipe_ids)
+        self.viewer_state.expect(
+            'subscriptions', [recipe.author_id for recipe in recipes])
+
+    def build_url(self, url):
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_images(self, obj):
+        return {
+            size_name: {
+                extension: self.build_url(url)
+                for extension, url in formats.items()}
+            for size_name, formats in rendition_urls(obj).items()}
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return (user is not None
-                and user.is_authenticated
-                and user.favorites.filter(recipe=obj).exists())
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return self.viewer_state.has('favorites', obj.pk)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (user is not None
-                and user.is_authenticated
-                and user.shopping_cart.filter(recipe=obj).exists())
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return self.viewer_state.has('shopping_cart', obj.pk)
+
+
+class PantryRecipeSerializer(RecipeReadSerializer):
+    coverage = FloatField(read_only=True)
+    missing = IntegerField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('coverage', 'missing')
 
 
 class RecipeMiniSerializer(RecipeReadSerializer):
+    image = SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('id', 'name', 'image', 'cooking_time')
 
+    def get_image(self, obj):
+        thumbnail = rendition_urls(obj).get('thumbnail')
+        if thumbnail:
+            return self.build_url(thumbnail['jpeg'])
+        return self.build_url(obj.image.url) if obj.image else None
+
 
 class SubscriptionSerializer(CustomUserSerializer):
     recipes = SerializerMethodField()
@@ -184,11 +372,16 @@ class SubscriptionSerializer(CustomUserSerializer):
         fields = (*CustomUserSerializer.Meta.fields,
                   'recipes', 'recipes_count')
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
+        list_serializer_class = ViewerListSerializer
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
+        if hasattr(obj, 'limited_recipes'):
+            return RecipeMiniSerializer(
+                obj.limited_recipes, many=True, read_only=True
+            ).data
         limit = self.context.get(
             'request').GET.get('recipes_limit')
         try:
@@ -203,50 +396,6 @@ class SubscriptionSerializer(CustomUserSerializer):
         ).data
 
 
-class CreateFavoriteSerializer(ModelSerializer):
-    class Meta:
-        model = Favorite
-        fields = (
-            'recipe',
-            'user'
-        )
-
-    def validate(self, attrs):
-        user = attrs['user']
-        recipe = attrs['recipe']
-        if Favorite.objects.filter(user=user, recipe=recipe).exists():
-            raise ValidationError('Уже в избранном')
-        return attrs
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        return RecipeMiniSerializer(
-            instance.recipe, context={'request': request}
-        ).data
-
-
-class CreateShoppingCartSerializer(ModelSerializer):
-    class Meta:
-        model = ShoppingCart
-        fields = (
-            'recipe',
-            'user'
-        )
-
-    def validate(self, attrs):
-        user = attrs['user']
-        recipe = attrs['recipe']
-        if ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
-            raise ValidationError('Уже в покупках')
-        return attrs
-
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        return RecipeMiniSerializer(
-            instance.recipe, context={'request': request}
-        ).data
-
-
 class SubscriptionCreateSerializer(ModelSerializer):
 
     class Meta(CustomUserSerializer.Meta):
@@ -276,3 +425,18 @@ class SubscriptionCreateSerializer(ModelSerializer):
                 'Уже есть подписка'
             )
         return data
+
+
+class IdListSerializer(Serializer):
+    ids = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RELATIONS_LIMIT)
+
+
+class PantrySerializer(Serializer):
+    ingredients = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_INGREDIENTS_LIMIT)
+    max_missing = IntegerField(min_value=0, required=False)
@@ -0,0 +1,104 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from django.dispatch import receiver
+from recipes.images import renditions_ready
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.relations import relations_changed
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+from .authentication import invalidate_tokens
+from .cache import (bump_popularity_generation, bump_recipes_generation,
+                    bump_viewer_generation)
+
+User = get_user_model()
+
+# Поля автора, которые попадают в закэшированные страницы рецептов.
+AUTHOR_FIELDS = ('username', 'email', 'first_name', 'last_name')
+# Поля, при изменении которых закэшированный по токену пользователь
+# устаревает: снимок из api.authentication и пароль. Вход меняет только
+# last_login, и токены при этом не сбрасываются.
+CREDENTIAL_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.editable and field.attname != 'last_login')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(renditions_ready, sender=Recipe)
+def recipes_changed(**kwargs):
+    transaction.on_commit(bump_recipes_generation)
+
+
+def field_values(user, names):
+    return tuple(user.__dict__.get(name) for name in names)
+
+
+@receiver(post_init, sender=User)
+def user_loaded(instance, **kwargs):
+    instance._author_fields = field_values(instance, AUTHOR_FIELDS)
+    instance._credential_fields = field_values(instance, CREDENTIAL_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, update_fields=None, **kwargs):
+    """Сбрасывает кэш рецептов, только если изменились данные автора:
+    регистрация, вход и смена пароля на страницы рецептов не влияют."""
+    current = field_values(instance, AUTHOR_FIELDS)
+    previous, instance._author_fields = instance._author_fields, current
+    if created or current == previous or (
+            update_fields is not None
+            and not set(update_fields) & set(AUTHOR_FIELDS)):
+        return
+    transaction.on_commit(bump_recipes_generation)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(**kwargs):
+    transaction.on_commit(bump_recipes_generation)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_tokens((instance.key,)))
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(instance, created, update_fields=None,
+                             **kwargs):
+    current = field_values(instance, CREDENTIAL_FIELDS)
+    previous, instance._credential_fields = (
+        instance._credential_fields, current)
+    if created or current == previous or (
+            update_fields is not None
+            and not set(update_fields) & set(CREDENTIAL_FIELDS)):
+        return
+    keys = list(Token.objects.filter(
+        user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscription)
+def viewer_changed(instance, **kwargs):
+    transaction.on_commit(lambda: bump_viewer_generation(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def popularity_changed(**kwargs):
+    transaction.on_commit(bump_popularity_generation)
+
+
+@receiver(relations_changed)
+def relations_bulk_changed(sender, user_id, **kwargs):
+    transaction.on_commit(lambda: bump_viewer_generation(user_id))
+    if sender is Favorite:
+        transaction.on_commit(bump_popularity_generation)
@@ -0,0 +1,253 @@
+import base64
+import re
+import shutil
+import tempfile
+from collections import Counter
+from io import BytesIO
+from itertools import combinations, product
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.counters import reconcile_counters
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.shopping_list import actual_totals, expected_totals
+from rest_framework.test import APIClient
+from users.models import Subscription
+
+from .cache import bump_recipes_generation
+from .filters import RecipeFilter
+
+User = get_user_model()
+
+WRITE = re.compile(r'^(INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.I)
+
+
+class RecipeDataMixin:
+    """Авторы, теги, ингредиенты и рецепты разного размера."""
+
+    recipes_count = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Автор', last_name='Рецептов', password='Pass12345!')
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Читатель', last_name='Рецептов', password='Pass12345!')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color=f'#00000{index}',
+                slug=f'tag-{index}')
+            for index in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(8)]
+        cls.recipes = []
+        for index in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {index}', text='Описание',
+                cooking_time=10, image='recipes/images/recipe.png')
+            recipe.tags.set(cls.tags[:index % len(cls.tags) + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=10)
+                for ingredient in cls.ingredients[:index % 6 + 1])
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.viewer, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.viewer, recipe=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+
+class RecipeReadQueriesTest(RecipeDataMixin, TestCase):
+    """Число запросов при чтении рецептов не зависит от данных."""
+
+    def assert_constant(self, client, urls, prepare=None):
+        counts = {}
+        for url in urls:
+            if prepare is not None:
+                prepare()
+            counts[url] = self.count_queries(client, url)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        urls = [f'/api/recipes/?limit={limit}' for limit in (1, 5, 20, 50)]
+        for client in (self.anonymous, self.client):
+            with self.subTest(authenticated=client is self.client):
+                self.count_queries(client, '/api/recipes/')
+                self.assert_constant(
+                    client, urls, prepare=bump_recipes_generation)
+
+    def test_retrieve_queries_do_not_depend_on_recipe_size(self):
+        urls = [f'/api/recipes/{recipe.pk}/'
+                for recipe in (self.recipes[0], self.recipes[-1])]
+        for client in (self.anonymous, self.client):
+            with self.subTest(authenticated=client is self.client):
+                self.assert_constant(client, urls)
+
+
+class RecipeFilterQueryTest(RecipeDataMixin, TestCase):
+    """Любое сочетание фильтров списка рецептов дает один плоский
+    запрос: без JOIN, DISTINCT и дублей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        other = Recipe.objects.create(
+            author=cls.viewer, name='Рецепт читателя', text='Описание',
+            cooking_time=10, image='recipes/images/recipe.png')
+        other.tags.set(cls.tags)
+        for recipe in (cls.recipes[2], cls.recipes[3], other):
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+
+    def combinations(self):
+        slugs = [tag.slug for tag in self.tags]
+        tag_sets = [()] + [
+            tags for size in (1, 2) for tags in combinations(slugs, size)]
+        for tags, favorited, in_cart, by_author, popular in product(
+                tag_sets, (False, True), (False, True),
+                (False, True), (False, True)):
+            params = QueryDict(mutable=True)
+            params.setlist('tags', tags)
+            if favorited:
+                params['is_favorited'] = '1'
+            if in_cart:
+                params['is_in_shopping_cart'] = '1'
+            if by_author:
+                params['author'] = str(self.author.pk)
+            if popular:
+                params['ordering'] = 'popular'
+            yield params
+
+    def expected(self, params):
+        recipes = Recipe.objects.all()
+        tags = params.getlist('tags')
+        if tags:
+            recipes = recipes.filter(tags__slug__in=tags)
+        if params.get('is_favorited'):
+            recipes = recipes.filter(in_favorites__user=self.viewer)
+        if params.get('is_in_shopping_cart'):
+            recipes = recipes.filter(in_shopping_cart__user=self.viewer)
+        if params.get('author'):
+            recipes = recipes.filter(author=params['author'])
+        return set(recipes.values_list('id', flat=True))
+
+    def test_filter_combinations(self):
+        request = SimpleNamespace(user=self.viewer)
+        for params in self.combinations():
+            with self.subTest(params=params.urlencode()):
+                filterset = RecipeFilter(
+                    data=params, queryset=Recipe.objects.all(),
+                    request=request)
+                self.assertTrue(filterset.is_valid(), filterset.errors)
+                sql = str(filterset.qs.query).upper()
+                self.assertNotIn(' JOIN ', sql)
+                self.assertNotIn('DISTINCT', sql)
+                with self.assertNumQueries(1):
+                    ids = list(filterset.qs.values_list('id', flat=True))
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(set(ids), self.expected(params))
+
+
+class RecipeEditWritesTest(RecipeDataMixin, TestCase):
+    """Правка рецепта меняет только изменившиеся строки ингредиентов
+    и тегов."""
+
+    tables = (RecipeIngredient._meta.db_table,
+              Recipe.tags.through._meta.db_table)
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(
+            MEDIA_ROOT=media_root, IMAGE_RENDITION_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def get_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (8, 8), 'green').save(buffer, 'PNG')
+        return ('data:image/png;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+
+    def request(self, method, url, payload):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.author_client, method)(
+                url, payload, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        writes = Counter()
+        for query in context.captured_queries:
+            match = WRITE.match(query['sql'])
+            if match and match.group(2) in self.tables:
+                writes[(match.group(1).split()[0].upper(),
+                        match.group(2))] += 1
+        return response, writes
+
+    def test_only_changed_rows_are_written(self):
+        payload = {
+            'tags': [tag.pk for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10}
+                for ingredient in self.ingredients[:5]],
+            'name': 'Проверка правки рецепта',
+            'image': self.get_image(),
+            'text': 'Описание',
+            'cooking_time': 30,
+        }
+        response, _ = self.request('post', '/api/recipes/', payload)
+        url = f'/api/recipes/{response.json()["id"]}/'
+        _, writes = self.request('patch', url, payload)
+        self.assertEqual(writes, Counter())
+        payload['ingredients'][0]['amount'] += 1
+        _, writes = self.request('patch', url, payload)
+        self.assertEqual(writes, Counter(
+            {('UPDATE', RecipeIngredient._meta.db_table): 1}))
+
+
+class CountersTest(RecipeDataMixin, TestCase):
+    """Счетчики и списки покупок верны при изменениях в обход API."""
+
+    def assert_consistent(self):
+        self.assertEqual(set(reconcile_counters(fix=False).values()), {0})
+        self.assertEqual(actual_totals(), expected_totals())
+
+    def test_orm_changes_and_cascades(self):
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipes[1])
+        Favorite.objects.create(user=self.author, recipe=self.recipes[2])
+        Subscription.objects.create(user=self.viewer, author=self.author)
+        self.assert_consistent()
+        self.recipes[1].delete()
+        self.assert_consistent()
+        self.viewer.delete()
+        self.assert_consistent()
+
+    def test_api_removal(self):
+        self.client.post(f'/api/recipes/{self.recipes[2].pk}/shopping_cart/')
+        for url in (f'/api/recipes/{self.recipes[0].pk}/favorite/',
+                    f'/api/recipes/{self.recipes[1].pk}/shopping_cart/'):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assert_consistent()
@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .profiling import metrics_view
 from .views import (IngredientViewSet, RecipeViewSet,
                     TagViewSet, CustomUserViewSet)
 
@@ -14,6 +15,7 @@ router.register('recipes', RecipeViewSet)
 router.register('users', CustomUserViewSet)
 
 urlpatterns = [
+    path('internal/metrics/', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
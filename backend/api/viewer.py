@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+RELATIONS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'shopping_cart': (ShoppingCart, 'recipe_id'),
+    'subscriptions': (Subscription, 'author_id'),
+}
+
+
+class ViewerState:
+    """Избранное, покупки и подписки текущего пользователя на один запрос.
+
+    Сериализаторы списков заранее передают id объектов страницы через
+    expect(). При первом вопросе о связи одного вида она загружается
+    одним запросом, и только для этих id.
+    """
+
+    def __init__(self, user):
+        self.user = (user if user is not None and user.is_authenticated
+                     else None)
+        self.expected = defaultdict(set)
+        self.known = defaultdict(dict)
+
+    @classmethod
+    def for_request(cls, request):
+        if request is None:
+            return cls(None)
+        user = request.user
+        request = getattr(request, '_request', request)
+        state = getattr(request, 'viewer_state', None)
+        if state is None:
+            state = request.viewer_state = cls(user)
+        return state
+
+    def expect(self, relation, ids):
+        if self.user is not None:
+            self.expected[relation].update(ids)
+
+    def has(self, relation, pk):
+        if self.user is None:
+            return False
+        known = self.known[relation]
+        if pk not in known:
+            ids = self.expected[relation].difference(known) | {pk}
+            model, field = RELATIONS[relation]
+            found = set(model.objects.filter(
+                user=self.user, **{f'{field}__in': ids}
+            ).values_list(field, flat=True))
+            known.update({id: id in found for id in ids})
+        return known[pk]
@@ -1,12 +1,16 @@
-from datetime import datetime
-
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
+from recipes import relations
+from recipes.pantry import pantry_index
+from recipes.search import ingredient_index
+from foodgram.constants import BULK_RECIPES_LIMIT
 from users.models import Subscription, User
 from rest_framework import status
 from rest_framework.decorators import action
@@ -15,24 +19,38 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
+from .cache import RecipeListCache
+from .exporters import EXPORTERS
 from .filters import RecipeFilter, IngredientFilter
-from .pagination import CustomPagination
+from .pagination import CustomPagination, PagePagination
 from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeReadSerializer,
-                          RecipeWriteSerializer, TagSerializer,
-                          CreateFavoriteSerializer, SubscriptionSerializer,
-                          SubscriptionCreateSerializer,
-                          CreateShoppingCartSerializer)
+from .profiling import ProfiledViewMixin
+from .serializers import (IdListSerializer, ImageUploadSerializer,
+                          IngredientSerializer, PantryRecipeSerializer,
+                          PantrySerializer, RecipeMiniSerializer,
+                          RecipeReadSerializer, RecipeWriteSerializer,
+                          TagSerializer, SubscriptionSerializer,
+                          SubscriptionCreateSerializer)
+
 
+def change_relations(relation, request):
+    """Добавляет или удаляет связи пользователя по списку id."""
+    serializer = IdListSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    change = relation.add if request.method == 'POST' else relation.remove
+    results = change(request.user.id, serializer.validated_data['ids'])
+    return Response({'results': [
+        {'id': pk, 'status': result} for pk, result in results.items()]})
 
-class TagViewSet(ReadOnlyModelViewSet):
+
+class TagViewSet(ProfiledViewMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly, )
     pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ProfiledViewMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly, )
@@ -40,13 +58,67 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        as_json = request.accepted_renderer.format == 'json'
+        query = request.query_params.get('search')
+        if query:
+            limit = request.query_params.get('limit', '')
+            options = {'limit': int(limit)} if limit.isdigit() else {}
+            if as_json:
+                return HttpResponse(
+                    ingredient_index.ranked_json(query, **options),
+                    content_type='application/json')
+            return Response(ingredient_index.ranked(query, **options))
+        name = request.query_params.get('name', '')
+        if as_json:
+            return HttpResponse(ingredient_index.search_json(name),
+                                content_type='application/json')
+        return Response(ingredient_index.search(name))
+
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ProfiledViewMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     filter_backends = (DjangoFilterBackend,)
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = CustomPagination
     filterset_class = RecipeFilter
+    viewer_agnostic = False
+
+    def get_queryset(self):
+        if self.action not in ('list', 'retrieve'):
+            return Recipe.objects.all()
+        return self.get_read_queryset()
+
+    def get_read_queryset(self):
+        user = self.request.user
+        if user.is_authenticated and not self.viewer_agnostic:
+            authors = User.objects.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef('pk'))))
+            flags = dict(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))))
+        else:
+            authors = User.objects.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+            flags = dict(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()))
+        return Recipe.objects.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch('recipeingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        ).annotate(**flags)
+
+    def list(self, request, *args, **kwargs):
+        self.viewer_agnostic = True
+        render = super().list
+        return Response(RecipeListCache(request).get_or_render(
+            lambda: render(request, *args, **kwargs).data))
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -56,6 +128,71 @@ class RecipeViewSet(ModelViewSet):
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_create(self, request):
+        if not isinstance(request.data, list):
+            return Response({'errors': 'Ожидался список рецептов'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > BULK_RECIPES_LIMIT:
+            return Response(
+                {'errors': f'Не больше {BULK_RECIPES_LIMIT} рецептов '
+                           f'за один запрос'},
+                status=status.HTTP_400_BAD_REQUEST)
+        serializer = RecipeWriteSerializer(
+            data=request.data, many=True,
+            context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            recipes = serializer.save(author=request.user)
+        recipes = self.get_read_queryset().filter(
+            id__in=[recipe.id for recipe in recipes])
+        return Response(
+            RecipeReadSerializer(
+                recipes, many=True, context=self.get_serializer_context()
+            ).data,
+            status=status.HTTP_201_CREATED)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        url_path='pantry',
+        pagination_class=PagePagination
+    )
+    def pantry(self, request):
+        serializer = PantrySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        page = self.paginate_queryset(
+            pantry_index.rank(**serializer.validated_data))
+        recipes = self.get_read_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        found = []
+        for recipe_id, have, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = round(have / total, 4)
+                recipe.missing = total - have
+                found.append(recipe)
+        return self.get_paginated_response(PantryRecipeSerializer(
+            found, many=True, context=self.get_serializer_context()).data)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='images',
+        permission_classes=(IsAuthenticated,)
+    )
+    def upload_image(self, request):
+        serializer = ImageUploadSerializer(
+            data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(
         methods=['POST'],
         detail=True,
@@ -63,14 +200,20 @@ class RecipeViewSet(ModelViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def favorite(self, request, pk):
-        user = request.user
-        data = {'user': user.id, 'recipe': pk}
-        return self.add_to(CreateFavoriteSerializer(
-            data=data, context={'request': request}))
+        return self.add_to(relations.favorites, pk, 'Уже в избранном')
+
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='favorite/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_favorite(self, request):
+        return change_relations(relations.favorites, request)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        return self.delete_from(Favorite, request.user, pk)
+        return self.delete_from(relations.favorites, pk)
 
     @action(
         detail=True,
@@ -78,27 +221,39 @@ class RecipeViewSet(ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def shopping_cart(self, request, pk):
-        user = request.user
-        data = {'user': user.id, 'recipe': pk}
-        return self.add_to(
-            CreateShoppingCartSerializer(
-                data=data, context={"request": request}))
+        return self.add_to(relations.shopping_cart, pk, 'Уже в покупках')
+
+    @action(
+        methods=['POST', 'DELETE'],
+        detail=False,
+        url_path='shopping_cart/bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def bulk_shopping_cart(self, request):
+        return change_relations(relations.shopping_cart, request)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        return self.delete_from(ShoppingCart, request.user, pk)
+        return self.delete_from(relations.shopping_cart, pk)
 
-    def add_to(self, serializer):
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+    def add_to(self, relation, pk, message):
+        recipe = Recipe.objects.filter(pk=pk).first()
+        if recipe is None:
+            return Response({'errors': 'Рецепт не найден'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not relation.add_one(self.request.user.id, recipe.id):
+            return Response({'errors': message},
+                            status=status.HTTP_400_BAD_REQUEST)
         return Response(
-            serializer.data, status=status.HTTP_201_CREATED
+            RecipeMiniSerializer(
+                recipe, context=self.get_serializer_context()).data,
+            status=status.HTTP_201_CREATED
         )
 
-    def delete_from(self, model, user, pk):
-        get_object_or_404(Recipe, id=pk)
-        delete_cnt, _ = model.objects.filter(user=user, recipe__id=pk).delete()
-        if not delete_cnt:
+    def delete_from(self, relation, pk):
+        recipe = get_object_or_404(Recipe, id=pk)
+        results = relation.remove(self.request.user.id, [recipe.id])
+        if results[recipe.id] != relations.REMOVED:
             return Response(
                 {'errors': 'Рецепт уже удален!'},
                 status=status.HTTP_400_BAD_REQUEST)
@@ -110,43 +265,15 @@ class RecipeViewSet(ModelViewSet):
         url_path='download_shopping_cart',
         permission_classes=(IsAuthenticated,)
     )
-    @action(
-        detail=False,
-        permission_classes=[IsAuthenticated]
-    )
     def download_shopping_cart(self, request):
         user = request.user
-        if not user.shopping_cart.exists():
+        exporter = EXPORTERS.get(request.query_params.get('type', 'txt'))
+        if exporter is None or not user.shopping_cart.exists():
             return Response(status=HTTP_400_BAD_REQUEST)
+        return exporter(user).get_response()
 
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        today = datetime.today()
-        shopping_list = (
-            f'Список покупок для: {user.get_full_name()}\n\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
-        )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-        shopping_list += f'\n\nFoodgram ({today:%Y})'
-
-        filename = f'{user.username}_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-
-        return response
 
-
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(ProfiledViewMixin, UserViewSet):
     pagination_class = CustomPagination
     permission_classes = (IsAuthorOrReadOnly,)
 
@@ -176,23 +303,38 @@ class CustomUserViewSet(UserViewSet):
 
     @subscribtion.mapping.delete
     def delete_subscribtion(self, request, id):
-        user = request.user
         author = get_object_or_404(User, id=id)
-        delete_cnt, _ = Subscription.objects.filter(
-            user=user, author=author).delete()
-        if not delete_cnt:
+        results = relations.subscriptions.remove(request.user.id, [author.id])
+        if results[author.id] != relations.REMOVED:
             return Response(
                 {'errors': 'Подписка уже удалена!'},
                 status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=('POST', 'DELETE'),
+            detail=False,
+            url_path='subscribe/bulk',
+            permission_classes=(IsAuthenticated,))
+    def bulk_subscribe(self, request):
+        return change_relations(relations.subscriptions, request)
+
     @action(methods=('GET',),
             detail=False,
             url_path='subscriptions',
             permission_classes=(IsAuthenticated,))
     def get_subscribtions(self, request):
+        recipes = Recipe.objects.all()
+        limit = request.GET.get('recipes_limit')
+        if limit is not None and limit.isdigit():
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')).values('id')[:int(limit)]))
         pages = self.paginate_queryset(
-            User.objects.filter(subscriptions__user=request.user))
+            User.objects.filter(subscriptions__user=request.user).annotate(
+                is_subscribed=Value(True, output_field=BooleanField()),
+            ).prefetch_related(
+                Prefetch('recipe', queryset=recipes, to_attr='limited_recipes')
+            ))
         serializer = SubscriptionSerializer(
             pages, many=True, context=self.get_serializer_context())
         return self.get_paginated_response(serializer.data)
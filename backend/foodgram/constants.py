@@ -8,3 +8,18 @@ MASSAGE_E_AMOUNT = (f'Некоректное кол-во'
                     f'{MIN_AMOUNT} макс знач {MAX_AMOUNT}')
 PAG_LIMIT = 6
 IS_POSTGRES = True
+INGREDIENT_SEARCH_LIMIT = 10
+INGREDIENT_FUZZY_THRESHOLD = 0.3
+RECIPE_CACHE_TIMEOUT = 60 * 60
+IMAGE_RENDITIONS = {
+    'thumbnail': (320, 320),
+    'card': (800, 800),
+    'full': (1600, 1600),
+}
+BULK_RECIPES_LIMIT = 100
+BULK_RELATIONS_LIMIT = 500
+ADMIN_EXACT_COUNT_LIMIT = 10000
+RECIPE_SEARCH_CONFIG = 'russian'
+PANTRY_INGREDIENTS_LIMIT = 100
+PANTRY_JOURNAL_SIZE = 1000
+PANTRY_JOURNAL_TIMEOUT = 24 * 60 * 60
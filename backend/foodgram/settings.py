@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +85,20 @@ else:
         }
     }
 
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -107,7 +122,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
@@ -144,4 +159,25 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+
+QUERY_PROFILER = os.getenv('QUERY_PROFILER', 'True') == 'True'
+QUERY_PROFILER_SERVER_TIMING = (
+    os.getenv('QUERY_PROFILER_SERVER_TIMING', 'False') == 'True')
+QUERY_PROFILER_SLOW_MS = int(os.getenv('QUERY_PROFILER_SLOW_MS', 500))
+QUERY_PROFILER_SLOW_QUERIES = int(
+    os.getenv('QUERY_PROFILER_SLOW_QUERIES', 30))
+QUERY_PROFILER_TRACE_RATE = float(
+    os.getenv('QUERY_PROFILER_TRACE_RATE', 0.1))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 10000))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 30))
+AUTH_TOKEN_SHARED_CACHE_TTL = int(os.getenv(
+    'AUTH_TOKEN_SHARED_CACHE_TTL', 300 if os.getenv('REDIS_URL') else 0))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
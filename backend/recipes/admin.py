@@ -1,26 +1,111 @@
 from django.contrib import admin
 from django.contrib.admin import display
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag)
+from foodgram.constants import ADMIN_EXACT_COUNT_LIMIT
+
+from .fulltext import index_recipes
+from .shopping_list import tracking_recipes
+from .models import (Favorite, ImageUpload, Ingredient, Recipe,
+                     RecipeIngredient, ShoppingCart, ShoppingListItem, Tag)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для больших таблиц без фильтров берет оценку числа строк
+    из статистики PostgreSQL вместо COUNT(*)."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[self.object_list.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE relname = %s',
+                        [query.model._meta.db_table])
+                    row = cursor.fetchone()
+                if row and row[0] > ADMIN_EXACT_COUNT_LIMIT:
+                    return int(row[0])
+        return super().count
+
+
+class LargeTableMixin:
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class RelationAdminMixin:
+    """Связь нельзя перенести на другой объект: счетчики меняются
+    сигналами только при создании и удалении связи."""
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return self.raw_id_fields
+        return super().get_readonly_fields(request, obj)
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр с полем ввода вместо списка всех значений."""
+
+    template = 'admin/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ((),)
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = (
+            (key, value) for key, value in changelist.params.items()
+            if key not in (self.parameter_name, PAGE_VAR))
+        yield all_choice
+
+
+class AuthorFilter(InputFilter):
+    title = 'автору'
+    parameter_name = 'author'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(author__username=self.value())
+        return queryset
 
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipe', 'ingredient')
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('name', 'id', 'author', 'get_ingredients',
                     'get_tags', 'added_in_favorites')
     readonly_fields = ('added_in_favorites',)
-    list_filter = ('author', 'name', 'tags',)
+    list_filter = (AuthorFilter, 'tags',)
+    search_fields = ('^name',)
+    autocomplete_fields = ('author', 'tags')
     inlines = (
         RecipeIngredientInline,
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author').prefetch_related('tags', 'ingredients')
+
+    def save_related(self, request, form, formsets, change):
+        with tracking_recipes((form.instance.pk,)):
+            super().save_related(request, form, formsets, change)
+        index_recipes((form.instance.pk,))
+
     @admin.display(description='Ингредиенты')
     def get_ingredients(self, obj):
         return '\t'.join(
@@ -33,32 +118,68 @@ class RecipeAdmin(admin.ModelAdmin):
             tag.name for tag in obj.tags.all()
         )
 
-    @display(description='Количество в избранных')
+    @display(description='Количество в избранных',
+             ordering='favorites_count')
     def added_in_favorites(self, obj):
-        return obj.in_favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
-    list_filter = ('name',)
+    search_fields = ('^name',)
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug',)
+    search_fields = ('name', 'slug')
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(RelationAdminMixin, LargeTableMixin,
+                        admin.ModelAdmin):
     list_display = ('user', 'recipe',)
+    list_select_related = ('user', 'recipe')
+    raw_id_fields = ('user', 'recipe')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount',)
+    list_select_related = ('user', 'ingredient')
+    raw_id_fields = ('user', 'ingredient')
 
 
 @admin.register(Favorite)
-class FavouriteAdmin(admin.ModelAdmin):
+class FavouriteAdmin(RelationAdminMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ('user', 'recipe',)
+    list_select_related = ('user', 'recipe')
+    raw_id_fields = ('user', 'recipe')
 
 
 @admin.register(RecipeIngredient)
-class IngredientInRecipe(admin.ModelAdmin):
+class IngredientInRecipe(LargeTableMixin, admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount',)
+    list_select_related = ('recipe', 'ingredient')
+    raw_id_fields = ('recipe', 'ingredient')
+
+    def save_model(self, request, obj, form, change):
+        with tracking_recipes({obj.recipe_id, form.initial.get('recipe')}):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with tracking_recipes((obj.recipe_id,)):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with tracking_recipes(set(
+                queryset.values_list('recipe_id', flat=True))):
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(ImageUpload)
+class ImageUploadAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ('token', 'user', 'created',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
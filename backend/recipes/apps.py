@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .fulltext import create_search_index
+        from .indexes import create_pattern_indexes
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(create_pattern_indexes, sender=self)
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from users.models import Subscription
+
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+def change_counter(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def count_changed(related, instance, delta):
+    """Меняет счетчики объектов, на которые ссылается instance."""
+    for model, field, counted, lookup in COUNTERS:
+        if counted is related:
+            change_counter(model.objects.filter(
+                pk=getattr(instance, f'{lookup}_id')), field, delta)
+
+
+def count_of(model, lookup):
+    return Coalesce(
+        Subquery(model.objects.filter(
+            **{lookup: OuterRef('pk')}
+        ).order_by().values(lookup).annotate(
+            count=Count('pk')).values('count')),
+        Value(0),
+        output_field=IntegerField())
+
+
+def reconcile_counters(fix=True):
+    """Сверяет счетчики с данными и возвращает число расхождений."""
+    report = {}
+    for model, field, related, lookup in COUNTERS:
+        stale = model.objects.annotate(
+            actual_count=count_of(related, lookup)
+        ).exclude(**{field: F('actual_count')}).values_list('pk', flat=True)
+        report[f'{model.__name__}.{field}'] = stale.count()
+        if fix:
+            model.objects.filter(pk__in=list(stale)).update(
+                **{field: count_of(related, lookup)})
+    return report
@@ -0,0 +1,164 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from foodgram.constants import RECIPE_SEARCH_CONFIG
+
+from .models import Ingredient, Recipe, RecipeIngredient, RecipeSearchDocument
+from .search import normalize
+
+RECIPES = Recipe._meta.db_table
+RECIPE_INGREDIENTS = RecipeIngredient._meta.db_table
+INGREDIENTS = Ingredient._meta.db_table
+SEARCH = RecipeSearchDocument._meta.db_table
+
+
+class PostgresIndex:
+    """Таблица tsvector с GIN-индексом: название важнее ингредиентов,
+    ингредиенты важнее описания.
+
+    Внешнего ключа на рецепты нет: flush очищает только таблицы
+    моделей и без CASCADE не смог бы очистить таблицу рецептов.
+    Документы удаленных рецептов удаляет unindex_recipes.
+    """
+
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE TABLE {SEARCH} ('
+            f'rowid bigint PRIMARY KEY, document tsvector NOT NULL)')
+        cursor.execute(
+            f'CREATE INDEX {SEARCH}_document_idx '
+            f'ON {SEARCH} USING gin (document)')
+
+    def update(self, cursor, ids):
+        def vector(column, weight):
+            return (f"setweight(to_tsvector(%(config)s::regconfig, "
+                    f"translate({column}, 'ёЁ', 'еЕ')), '{weight}')")
+        ingredients = "coalesce(string_agg(i.name, ' '), '')"
+        where = '' if ids is None else 'WHERE r.id = ANY(%(ids)s)'
+        cursor.execute(
+            f'INSERT INTO {SEARCH} (rowid, document) '
+            f'SELECT r.id, {vector("r.name", "A")} || '
+            f'{vector(ingredients, "B")} || {vector("r.text", "C")} '
+            f'FROM {RECIPES} r '
+            f'LEFT JOIN {RECIPE_INGREDIENTS} ri ON ri.recipe_id = r.id '
+            f'LEFT JOIN {INGREDIENTS} i ON i.id = ri.ingredient_id '
+            f'{where} GROUP BY r.id '
+            f'ON CONFLICT (rowid) DO UPDATE '
+            f'SET document = EXCLUDED.document',
+            {'config': RECIPE_SEARCH_CONFIG, 'ids': ids})
+
+    def remove(self, cursor, ids):
+        cursor.execute(
+            f'DELETE FROM {SEARCH} WHERE rowid = ANY(%s)', [ids])
+
+    def match(self, terms):
+        query = ' & '.join(f'{term}:*' for term in terms)
+        params = (RECIPE_SEARCH_CONFIG, query)
+        tsquery = 'to_tsquery(%s::regconfig, %s)'
+        # float8, чтобы значение из курсора пагинации совпадало точно.
+        return (
+            RawSQL(f'{SEARCH}.document @@ {tsquery}', params,
+                   output_field=BooleanField()),
+            RawSQL(f'ts_rank({SEARCH}.document, {tsquery})::float8',
+                   params, output_field=FloatField()))
+
+
+class SQLiteIndex:
+    """Виртуальная таблица FTS5, rowid совпадает с id рецепта."""
+
+    def create(self, cursor):
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE {SEARCH} USING fts5('
+            f'name, ingredients, text, '
+            f"tokenize = 'unicode61 remove_diacritics 2')")
+
+    def update(self, cursor, ids):
+        def text(column):
+            return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+        where, params = '', []
+        if ids is not None:
+            where = f'WHERE r.id IN ({", ".join(["%s"] * len(ids))})'
+            params = list(ids)
+        else:
+            cursor.execute(f'DELETE FROM {SEARCH}')
+        ingredients = "coalesce(group_concat(i.name, ' '), '')"
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {SEARCH} '
+            f'(rowid, name, ingredients, text) '
+            f'SELECT r.id, {text("r.name")}, {text(ingredients)}, '
+            f'{text("r.text")} FROM {RECIPES} r '
+            f'LEFT JOIN {RECIPE_INGREDIENTS} ri ON ri.recipe_id = r.id '
+            f'LEFT JOIN {INGREDIENTS} i ON i.id = ri.ingredient_id '
+            f'{where} GROUP BY r.id', params)
+
+    def remove(self, cursor, ids):
+        cursor.execute(
+            f'DELETE FROM {SEARCH} '
+            f'WHERE rowid IN ({", ".join(["%s"] * len(ids))})', list(ids))
+
+    def match(self, terms):
+        query = ' '.join(f'"{term}"*' for term in terms)
+        return (
+            RawSQL(f'{SEARCH} MATCH %s', (query,),
+                   output_field=BooleanField()),
+            RawSQL(f'-bm25({SEARCH}, 10.0, 4.0, 1.0)', (),
+                   output_field=FloatField()))
+
+
+def get_index(connection):
+    if connection.vendor == 'postgresql':
+        return PostgresIndex()
+    return SQLiteIndex()
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Создает поисковый индекс рецептов, если его еще нет.
+
+    Вызывается и после flush: таблицы индекса нет среди таблиц
+    моделей, поэтому документы рецептов, которых больше нет,
+    удаляются здесь. Иначе они подошли бы новым рецептам с теми же id.
+    """
+    connection = connections[using]
+    index = get_index(connection)
+    with connection.cursor() as cursor:
+        if SEARCH not in connection.introspection.table_names(cursor):
+            index.create(cursor)
+            index.update(cursor, None)
+            return
+        cursor.execute(
+            f'DELETE FROM {SEARCH} WHERE rowid NOT IN '
+            f'(SELECT id FROM {RECIPES})')
+
+
+def index_recipes(ids=None, using=DEFAULT_DB_ALIAS):
+    """Обновляет документы рецептов; без ids пересобирает весь индекс."""
+    if ids is not None:
+        ids = list(ids)
+        if not ids:
+            return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        get_index(connection).update(cursor, ids)
+
+
+def unindex_recipes(ids, using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        get_index(connection).remove(cursor, list(ids))
+
+
+def search_recipes(recipes, query):
+    """Оставляет рецепты, подходящие под запрос, по убыванию релевантности.
+
+    Все слова запроса должны встретиться в названии, описании или
+    ингредиентах рецепта, слово может быть началом слова в тексте.
+    """
+    terms = re.findall(r'\w+', normalize(query))
+    if not terms:
+        return recipes
+    condition, rank = get_index(connections[recipes.db]).match(terms)
+    return recipes.filter(search_document__isnull=False).filter(
+        condition).annotate(search_rank=rank).order_by(
+            '-search_rank', '-pub_date')
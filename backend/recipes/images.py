@@ -0,0 +1,140 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, router
+from django.dispatch import Signal
+from foodgram.constants import IMAGE_RENDITIONS
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+renditions_ready = Signal()
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = Lock()
+
+
+def rendition_workers():
+    """SQLite блокирует базу при записи из второго потока, поэтому
+    с ней копии всегда строятся в текущем потоке."""
+    if connections[router.db_for_write(Recipe)].vendor == 'sqlite':
+        return 0
+    return settings.IMAGE_RENDITION_WORKERS
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=rendition_workers(),
+                thread_name_prefix='renditions')
+    return _executor
+
+
+def wait_for_renditions():
+    """Дожидается построения копий, уже поставленных в очередь."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def rendition_path(image_name, size_name, extension):
+    path = PurePosixPath(image_name)
+    return str(path.parent.joinpath(
+        'renditions', f'{path.stem}_{size_name}.{extension}'))
+
+
+def image_files(image_name):
+    """Файл изображения и все возможные файлы его копий."""
+    return [image_name, *(
+        rendition_path(image_name, size_name, extension)
+        for size_name in IMAGE_RENDITIONS
+        for extension in RENDITION_FORMATS)]
+
+
+def open_image(image_name):
+    with default_storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def build_renditions(image_name):
+    image = open_image(image_name)
+    renditions = {}
+    for size_name, size in IMAGE_RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        renditions[size_name] = {}
+        for extension, (image_format, options) in RENDITION_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            path = rendition_path(image_name, size_name, extension)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            renditions[size_name][extension] = default_storage.save(
+                path, ContentFile(buffer.getvalue()))
+    return renditions
+
+
+def process_recipe_image(recipe_id, image_name):
+    renditions = build_renditions(image_name)
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=image_name
+    ).update(image_renditions=renditions)
+    if updated:
+        renditions_ready.send(
+            sender=Recipe, recipe_id=recipe_id, renditions=renditions)
+
+
+def process_in_worker(recipe_id, image_name):
+    try:
+        process_recipe_image(recipe_id, image_name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', image_name)
+    finally:
+        connections.close_all()
+
+
+def schedule_renditions(recipe):
+    """Ставит в очередь построение уменьшенных копий изображения рецепта.
+
+    При IMAGE_RENDITION_WORKERS = 0 и на SQLite копии строятся сразу,
+    в текущем потоке. Очередь живет в процессе и теряется при его
+    перезапуске; недостроенные копии достраивает build_renditions.
+    """
+    if not recipe.image:
+        return None
+    if not rendition_workers():
+        return process_recipe_image(recipe.pk, recipe.image.name)
+    return get_executor().submit(
+        process_in_worker, recipe.pk, recipe.image.name)
+
+
+def rendition_urls(recipe):
+    return {
+        size_name: {
+            extension: default_storage.url(path)
+            for extension, path in formats.items()}
+        for size_name, formats in (recipe.image_renditions or {}).items()}
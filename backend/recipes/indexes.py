@@ -0,0 +1,22 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import Ingredient
+
+INGREDIENTS = Ingredient._meta.db_table
+
+
+def create_pattern_indexes(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Создает индексы, которые Django 3.2 не умеет объявлять в Meta.
+
+    Фильтр name__istartswith в PostgreSQL превращается в
+    UPPER(name::text) LIKE 'X%'. Такой запрос использует индекс по
+    выражению только с классом операторов text_pattern_ops, если
+    сортировка базы отличается от C.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS ingredient_upper_name_like_idx '
+            f'ON {INGREDIENTS} (UPPER(name::text) text_pattern_ops)')
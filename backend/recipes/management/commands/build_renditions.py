@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Перестроить копии и для рецептов, у которых они уже есть')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            recipes = recipes.filter(image_renditions={})
+        built = 0
+        for recipe_id, image_name in recipes.values_list(
+                'id', 'image').iterator():
+            process_recipe_image(recipe_id, image_name)
+            built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {built}'))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import ImageUpload
+
+
+class Command(BaseCommand):
+    help = 'Удаляет загруженные изображения, которые не попали в рецепты'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=24,
+            help='Удалять загрузки старше указанного числа часов')
+
+    def handle(self, *args, **options):
+        deleted = 0
+        uploads = ImageUpload.objects.filter(
+            created__lt=timezone.now() - timedelta(hours=options['hours']))
+        for upload in uploads.iterator():
+            upload.image.delete(save=False)
+            upload.delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено загрузок: {deleted}'))
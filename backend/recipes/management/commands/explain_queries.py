@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Печатает планы запросов, которые выполняет API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Выполнить запросы и показать фактическое время')
+
+    def get_querysets(self):
+        user = User.objects.order_by('pk').first()
+        recipe = Recipe.objects.first()
+        return {
+            'Список рецептов': Recipe.objects.all()[:6],
+            'Рецепты автора': Recipe.objects.filter(author=user)[:6],
+            'Флаги избранного и покупок': Recipe.objects.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))))[:6],
+            'Фильтр is_favorited': Recipe.objects.filter(
+                in_favorites__user=user)[:6],
+            'Кто добавил рецепт в избранное': Favorite.objects.filter(
+                recipe=recipe),
+            'Подписчики автора': User.objects.filter(
+                subscriptions_as_user__author=user),
+            'Подписки пользователя': User.objects.filter(
+                subscriptions__user=user)[:6],
+            'Поиск ингредиента по началу названия': Ingredient.objects.filter(
+                name__istartswith='сах'),
+        }
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        for title, queryset in self.get_querysets().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
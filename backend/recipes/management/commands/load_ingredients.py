@@ -0,0 +1,119 @@
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from time import monotonic
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from foodgram.constants import MAX_LENGTH
+
+from recipes.models import Ingredient
+from recipes.search import invalidate_ingredient_index
+
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield {'name': row[0],
+                   'measurement_unit': row[1] if len(row) > 1 else ''}
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json(file):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise CommandError('Ожидался JSON-массив')
+            buffer = buffer[1:]
+            started = True
+            continue
+        if started and buffer[:1] == ',':
+            buffer = buffer[1:]
+            continue
+        if started and buffer[:1] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Файл JSON оборван или поврежден')
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonl': read_jsonl,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV, JSON или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с ингредиентами')
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию берется из расширения')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одной транзакции')
+
+    def clean(self, rows):
+        for row in rows:
+            name = str(row.get('name') or '').strip()
+            unit = str(row.get('measurement_unit') or '').strip()
+            if (not name or not unit
+                    or len(name) > MAX_LENGTH or len(unit) > MAX_LENGTH):
+                self.skipped += 1
+                continue
+            yield name, unit
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        batch_size = options['batch_size']
+        self.skipped = 0
+        processed = 0
+        count_before = Ingredient.objects.count()
+        started = monotonic()
+        with path.open(encoding='utf-8', newline='') as file:
+            rows = self.clean(READERS[file_format](file))
+            while True:
+                batch = dict.fromkeys(islice(rows, batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    Ingredient.objects.bulk_create(
+                        [Ingredient(name=name, measurement_unit=unit)
+                         for name, unit in batch],
+                        ignore_conflicts=True)
+                processed += len(batch)
+        invalidate_ingredient_index()
+        elapsed = monotonic() - started
+        created = Ingredient.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {processed}, добавлено: {created}, '
+            f'пропущено: {self.skipped}, '
+            f'{processed / elapsed if elapsed else processed:.0f} строк/с'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from recipes.fulltext import create_search_index, index_recipes
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            create_search_index(using)
+            index_recipes(using=using)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: '
+            f'{Recipe.objects.using(using).count()}'))
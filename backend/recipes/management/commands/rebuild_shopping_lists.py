@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+from recipes.shopping_list import actual_totals, expected_totals
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает и проверяет агрегированные списки покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить списки покупок, не исправляя их')
+
+    def diff(self, expected):
+        actual = actual_totals()
+        return sorted(
+            user for user in expected.keys() | actual.keys()
+            if expected.get(user, {}) != actual.get(user, {}))
+
+    def handle(self, *args, **options):
+        expected = expected_totals()
+        broken = self.diff(expected)
+        self.stdout.write(
+            f'Пользователей с расхождениями: {len(broken)}')
+        if options['check']:
+            if broken:
+                raise CommandError(
+                    f'Расхождения у пользователей: {broken}')
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                                  amount=amount)
+                 for user, amounts in expected.items()
+                 for ingredient, amount in amounts.items()),
+                batch_size=1000)
+        broken = self.diff(expected_totals())
+        if broken:
+            raise CommandError(
+                f'Расхождения после пересборки: {broken}')
+        self.stdout.write(self.style.SUCCESS(
+            'Списки покупок пересобраны'))
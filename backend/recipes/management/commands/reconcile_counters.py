@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и исправляет счетчики избранного, покупок и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить счетчики, не исправляя их')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            report = reconcile_counters(fix=not options['check'])
+        for counter, stale in report.items():
+            self.stdout.write(f'{counter}: расхождений {stale}')
+        if options['check'] and any(report.values()):
+            raise CommandError('Счетчики расходятся с данными')
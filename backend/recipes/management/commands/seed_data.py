@@ -0,0 +1,194 @@
+import random
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+from users.models import Subscription
+
+from recipes.images import build_renditions
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.pantry import invalidate_pantry_index
+from recipes.search import invalidate_ingredient_index
+
+User = get_user_model()
+
+PREFIX = 'bench'
+PASSWORD = 'benchmark-password'
+IMAGE_NAME = 'static/recipe/bench.jpg'
+BATCH_SIZE = 1000
+
+
+class Skewed:
+    """Выбор элементов с распределением Ципфа: первые выбираются чаще."""
+
+    def __init__(self, items, skew, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.weights = list(accumulate(
+            1 / (rank + 1) ** skew for rank in range(len(self.items))))
+
+    def sample(self, count, exclude=None):
+        count = min(count, len(self.items) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < count:
+            item = self.rng.choices(self.items, cum_weights=self.weights)[0]
+            if item != exclude:
+                chosen.add(item)
+        return chosen
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу данными для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients', type=int, default=1000,
+            help='Сколько ингредиентов создать, если в базе их меньше')
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Среднее число рецептов в избранном у пользователя')
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Среднее число рецептов в списке покупок')
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Среднее число подписок пользователя')
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель распределения Ципфа для популярности')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить данные предыдущего заполнения')
+
+    def clear(self):
+        User.objects.filter(username__startswith=f'{PREFIX}_').delete()
+        Tag.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+
+    def around(self, mean):
+        return max(0, round(self.rng.expovariate(1 / mean))) if mean else 0
+
+    def save_image(self):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), 'orange').save(buffer, 'JPEG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        return IMAGE_NAME
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (User(username=f'{PREFIX}_{index}',
+                  email=f'{PREFIX}_{index}@example.com',
+                  first_name='Бенчмарк', last_name=str(index),
+                  password=password)
+             for index in range(count)),
+            batch_size=BATCH_SIZE)
+        return list(User.objects.filter(
+            username__startswith=f'{PREFIX}_'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_tags(self, count):
+        Tag.objects.bulk_create(
+            (Tag(name=f'{PREFIX} {index}', slug=f'{PREFIX}-{index}',
+                 color=f'#{self.rng.randrange(16 ** 6):06x}')
+             for index in range(count)),
+            ignore_conflicts=True)
+        return list(Tag.objects.filter(
+            slug__startswith=f'{PREFIX}-'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_ingredients(self, count):
+        missing = count - Ingredient.objects.count()
+        if missing > 0:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=f'{PREFIX} продукт {index}',
+                            measurement_unit=self.rng.choice(
+                                ('г', 'кг', 'мл', 'шт')))
+                 for index in range(missing)),
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        self.rng.shuffle(ingredients)
+        return ingredients
+
+    def create_recipes(self, count, authors, tags, ingredients):
+        image = self.save_image()
+        renditions = build_renditions(image)
+        Recipe.objects.bulk_create(
+            (Recipe(author_id=next(iter(authors.sample(1))),
+                    name=f'{PREFIX} рецепт {index}',
+                    text='Описание рецепта для нагрузочного теста. ' * 5,
+                    cooking_time=self.rng.randint(5, 180),
+                    image=image, image_renditions=renditions)
+             for index in range(count)),
+            batch_size=BATCH_SIZE)
+        recipes = list(Recipe.objects.filter(
+            author__username__startswith=f'{PREFIX}_'
+        ).order_by('pk').values_list('pk', flat=True))
+        RecipeIngredient.objects.bulk_create(
+            (RecipeIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                              amount=self.rng.randint(1, 500))
+             for recipe in recipes
+             for ingredient in ingredients.sample(self.rng.randint(3, 15))),
+            batch_size=BATCH_SIZE)
+        Recipe.tags.through.objects.bulk_create(
+            (Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+             for recipe in recipes
+             for tag in tags.sample(self.rng.randint(1, 3))),
+            batch_size=BATCH_SIZE)
+        return recipes
+
+    def create_relations(self, model, field, users, targets, mean):
+        model.objects.bulk_create(
+            (model(user_id=user, **{field: target})
+             for user in users
+             for target in targets.sample(
+                 self.around(mean),
+                 exclude=user if field == 'author_id' else None)),
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        skew = options['skew']
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            users = self.create_users(options['users'])
+            authors = Skewed(users, skew, self.rng)
+            tags = Skewed(self.create_tags(options['tags']), skew, self.rng)
+            ingredients = Skewed(
+                self.create_ingredients(options['ingredients']),
+                skew, self.rng)
+            recipes = Skewed(
+                self.create_recipes(
+                    options['recipes'], authors, tags, ingredients),
+                skew, self.rng)
+            self.create_relations(
+                Favorite, 'recipe_id', users, recipes, options['favorites'])
+            self.create_relations(
+                ShoppingCart, 'recipe_id', users, recipes, options['carts'])
+            self.create_relations(
+                Subscription, 'author_id', users, authors,
+                options['subscriptions'])
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        invalidate_ingredient_index()
+        invalidate_pantry_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {len(recipes.items)}, '
+            f'избранного: {Favorite.objects.count()}, '
+            f'покупок: {ShoppingCart.objects.count()}, '
+            f'подписок: {Subscription.objects.count()}'))
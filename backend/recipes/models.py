@@ -1,3 +1,5 @@
+from uuid import uuid4
+
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
@@ -67,6 +69,11 @@ class Recipe(models.Model):
         upload_to='static/recipe/',
         blank=True,
         null=True)
+    image_renditions = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False)
     text = models.TextField(
         'Описание рецепта')
     ingredients = models.ManyToManyField(
@@ -86,11 +93,27 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
         auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        'Количество в избранных',
+        default=0,
+        editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'Количество в списках покупок',
+        default=0,
+        editable=False)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', )
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date'],
+                         name='recipe_popular_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -130,6 +153,27 @@ class RecipeIngredient(models.Model):
         return f'{self.recipe} / {self.ingredient} / {self.amount}'
 
 
+class RecipeSearchDocument(models.Model):
+    """Документ полнотекстового индекса рецепта.
+
+    Таблицу создает и заполняет recipes.fulltext, поэтому модель не
+    управляется миграциями и нужна только для JOIN в поиске. Колонка
+    rowid совпадает с id рецепта и в PostgreSQL, и в FTS5 SQLite.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_document')
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_search'
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              verbose_name='Подписчик',
@@ -143,6 +187,8 @@ class Favorite(models.Model):
         verbose_name_plural = 'Избранное'
         constraints = [models.UniqueConstraint(fields=['user', 'recipe'],
                                                name='unique_favorites')]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='favorite_recipe_user_idx')]
 
     def __str__(self):
         return f'{self.user} добавил в избранное {self.recipe}'
@@ -161,3 +207,50 @@ class ShoppingCart(models.Model):
         verbose_name_plural = 'Список покупок'
         constraints = [models.UniqueConstraint(fields=['user', 'recipe'],
                                                name='unique_shoppingcart')]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='shoppingcart_recipe_user_idx')]
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='Пользователь',
+                             related_name='shopping_list')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   verbose_name='Продукт',
+                                   related_name='+')
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списка покупок'
+        ordering = ('ingredient__name', 'ingredient__measurement_unit')
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_list_item'
+        )]
+
+    def __str__(self):
+        return f'{self.user} / {self.ingredient} / {self.amount}'
+
+
+class ImageUpload(models.Model):
+    token = models.UUIDField(
+        primary_key=True,
+        default=uuid4,
+        editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='Пользователь',
+                             related_name='image_uploads')
+    image = models.ImageField(
+        'Изображение',
+        upload_to='static/recipe/')
+    created = models.DateTimeField(
+        'Дата загрузки',
+        auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Загруженное изображение'
+        verbose_name_plural = 'Загруженные изображения'
+
+    def __str__(self):
+        return f'{self.user} / {self.token}'
@@ -0,0 +1,311 @@
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from foodgram.constants import PANTRY_JOURNAL_SIZE, PANTRY_JOURNAL_TIMEOUT
+
+from .models import RecipeIngredient
+
+PANTRY_INDEX_VERSION_KEY = 'pantry_index_version'
+PANTRY_INDEX_SEQUENCE_KEY = 'pantry_index_sequence'
+PANTRY_INDEX_CHANGE_KEY = 'pantry_index_change:{}:{}'
+# Массив тратит 64 бита на рецепт, битовая карта -- бит на каждый id.
+BITMAP_DENSITY = 64
+
+
+def invalidate_pantry_index():
+    cache.set_many({PANTRY_INDEX_VERSION_KEY: uuid4().hex,
+                    PANTRY_INDEX_SEQUENCE_KEY: 0}, None)
+
+
+def record_recipe_changes(recipe_ids):
+    """Записывает в журнал изменившиеся рецепты.
+
+    Индексы всех процессов дочитывают журнал при следующем поиске и
+    перечитывают из базы только ингредиенты этих рецептов.
+    """
+    version = cache.get(PANTRY_INDEX_VERSION_KEY)
+    if version is None:
+        return
+    try:
+        sequence = cache.incr(PANTRY_INDEX_SEQUENCE_KEY)
+    except ValueError:
+        invalidate_pantry_index()
+        return
+    cache.set(PANTRY_INDEX_CHANGE_KEY.format(version, sequence),
+              list(recipe_ids), PANTRY_JOURNAL_TIMEOUT)
+
+
+def to_bitmap(recipe_ids):
+    """Битовая карта из отсортированных id."""
+    if not recipe_ids:
+        return 0
+    buffer = bytearray((recipe_ids[-1] >> 3) + 1)
+    for recipe in recipe_ids:
+        buffer[recipe >> 3] |= 1 << (recipe & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def add_bitmap(counter, bits):
+    """Прибавляет 1 к счетчикам рецептов из битовой карты.
+
+    Счетчик хранится по разрядам: counter[k] -- карта рецептов, у
+    которых k-й бит счетчика равен 1. Сложение идет сразу по всем
+    рецептам операциями над целыми числами.
+    """
+    for position, digit in enumerate(counter):
+        counter[position], bits = digit ^ bits, digit & bits
+        if not bits:
+            return
+    counter.append(bits)
+
+
+def highest(bits, skip, limit):
+    """id рецептов по убыванию, начиная с (skip + 1)-го."""
+    if skip:
+        low, high = 0, bits.bit_length()
+        while low < high:
+            middle = (low + high) // 2
+            if popcount(bits >> middle) <= skip:
+                high = middle
+            else:
+                low = middle + 1
+        bits &= (1 << low) - 1
+    recipes = []
+    while bits and len(recipes) < limit:
+        recipe = bits.bit_length() - 1
+        recipes.append(recipe)
+        bits ^= 1 << recipe
+    return recipes
+
+
+class PantryMatches:
+    """Найденные рецепты, сгруппированные по числу имеющихся и всех
+    ингредиентов. Поддерживает len() и срезы для пагинатора: id
+    достаются из битовых карт только для запрошенной страницы."""
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def __len__(self):
+        return sum(count for *_, count in self.groups)
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(len(self))
+        page = []
+        for have, total, bits, count in self.groups:
+            if start < count and stop > 0:
+                skip = max(start, 0)
+                page.extend(
+                    (recipe, have, total) for recipe in highest(
+                        bits, skip, min(stop, count) - skip))
+            start -= count
+            stop -= count
+        return page
+
+
+class PantryTable:
+    """Снимок индекса, который не меняется после создания.
+
+    Поиск берет ссылку на текущий снимок и читает только его, а
+    изменения рецептов собираются в новом снимке: словари копируются
+    целиком, массивы -- только у затронутых ингредиентов.
+    """
+
+    def __init__(self, postings, bitmaps, sizes, last):
+        self.postings = postings
+        self.bitmaps = bitmaps
+        self.sizes = sizes
+        self.last = last
+
+    def dense(self, recipe_ids):
+        return len(recipe_ids) * BITMAP_DENSITY >= self.last
+
+    def changed(self, changes):
+        """Новый снимок, в котором ингредиенты рецептов заменены.
+
+        changes -- кортежи (id рецепта, старые ингредиенты, новые).
+        """
+        table = PantryTable(dict(self.postings), dict(self.bitmaps),
+                            dict(self.sizes), self.last)
+        copied = set()
+        for recipe, old, new in changes:
+            if new:
+                table.last = max(table.last, recipe)
+            table._move(recipe, old, new, copied)
+        return table
+
+    def _posting(self, ingredient, copied):
+        recipes = self.postings.get(ingredient)
+        if ingredient not in copied:
+            recipes = array('q', recipes or ())
+            self.postings[ingredient] = recipes
+            copied.add(ingredient)
+        return recipes
+
+    def _move(self, recipe, old, new, copied):
+        bit = 1 << recipe
+        for ingredient in old - new:
+            recipes = self._posting(ingredient, copied)
+            position = bisect_left(recipes, recipe)
+            if position < len(recipes) and recipes[position] == recipe:
+                del recipes[position]
+            if not recipes:
+                del self.postings[ingredient]
+                copied.discard(ingredient)
+                self.bitmaps.pop(ingredient, None)
+            elif ingredient in self.bitmaps:
+                self.bitmaps[ingredient] &= ~bit
+        for ingredient in new - old:
+            recipes = self._posting(ingredient, copied)
+            insort(recipes, recipe)
+            if ingredient in self.bitmaps:
+                self.bitmaps[ingredient] |= bit
+            elif self.dense(recipes):
+                self.bitmaps[ingredient] = to_bitmap(recipes)
+        if old:
+            remaining = self.sizes[len(old)] & ~bit
+            if remaining:
+                self.sizes[len(old)] = remaining
+            else:
+                del self.sizes[len(old)]
+        if new:
+            self.sizes[len(new)] = self.sizes.get(len(new), 0) | bit
+
+    def rank(self, ingredients, max_missing=None):
+        counter = []
+        for ingredient in set(ingredients):
+            bits = self.bitmaps.get(ingredient)
+            if bits is None:
+                bits = to_bitmap(self.postings.get(ingredient, ()))
+            if bits:
+                add_bitmap(counter, bits)
+        mask = (1 << max(map(int.bit_length, counter), default=0)) - 1
+        groups = []
+        for have in range(1, 1 << len(counter)):
+            equal = mask
+            for position, digit in enumerate(counter):
+                equal &= digit if have >> position & 1 else ~digit
+            if not equal:
+                continue
+            for total, recipes in self.sizes.items():
+                if total < have or (
+                        max_missing is not None
+                        and total - have > max_missing):
+                    continue
+                bits = equal & recipes
+                if bits:
+                    groups.append((have, total, bits, popcount(bits)))
+        groups.sort(key=lambda group: (
+            -group[0] / group[1], group[1] - group[0], -group[0]))
+        return PantryMatches(groups)
+
+
+class PantryIndex:
+    """Обратный индекс ингредиентов в памяти процесса.
+
+    Для каждого ингредиента хранится отсортированный массив id
+    рецептов, для частых ингредиентов -- еще и битовая карта. Число
+    совпавших ингредиентов считается сложением битовых карт в
+    поразрядном счетчике, поэтому стоимость поиска зависит от числа
+    ингредиентов в запросе и разрядности id, а не от числа найденных
+    рецептов. Изменения рецептов применяются по журналу в кэше; если
+    журнал прервался или отстал больше чем на PANTRY_JOURNAL_SIZE
+    записей, индекс перестраивается целиком.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._sequence = 0
+        self._recipes = {}
+        self._table = PantryTable({}, {}, {}, 0)
+
+    def _rebuild(self, version, sequence):
+        postings = defaultdict(lambda: array('q'))
+        recipes = defaultdict(list)
+        rows = RecipeIngredient.objects.order_by('recipe_id').values_list(
+            'recipe_id', 'ingredient_id')
+        for recipe, ingredient in rows.iterator():
+            postings[ingredient].append(recipe)
+            recipes[recipe].append(ingredient)
+        sizes = defaultdict(list)
+        for recipe, ingredients in recipes.items():
+            sizes[len(ingredients)].append(recipe)
+        table = PantryTable(
+            dict(postings), {}, {
+                total: to_bitmap(recipe_ids)
+                for total, recipe_ids in sizes.items()},
+            max(recipes, default=0))
+        table.bitmaps = {
+            ingredient: to_bitmap(recipe_ids)
+            for ingredient, recipe_ids in postings.items()
+            if table.dense(recipe_ids)}
+        self._recipes = {
+            recipe: tuple(ingredients)
+            for recipe, ingredients in recipes.items()}
+        self._table = table
+        self._version = version
+        self._sequence = sequence
+
+    def _apply(self, recipe_ids):
+        current = defaultdict(set)
+        for recipe, ingredient in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                    'recipe_id', 'ingredient_id'):
+            current[recipe].add(ingredient)
+        changes = []
+        for recipe in recipe_ids:
+            new = current.get(recipe, set())
+            changes.append(
+                (recipe, set(self._recipes.get(recipe, ())), new))
+            if new:
+                self._recipes[recipe] = tuple(new)
+            else:
+                self._recipes.pop(recipe, None)
+        self._table = self._table.changed(changes)
+
+    def _sync(self):
+        version = cache.get_or_set(
+            PANTRY_INDEX_VERSION_KEY, uuid4().hex, None)
+        sequence = cache.get_or_set(PANTRY_INDEX_SEQUENCE_KEY, 0, None)
+        if version == self._version and sequence == self._sequence:
+            return self._table
+        with self._lock:
+            if version != self._version or (
+                    sequence - self._sequence > PANTRY_JOURNAL_SIZE):
+                self._rebuild(version, sequence)
+                return self._table
+            if sequence <= self._sequence:
+                return self._table
+            keys = [PANTRY_INDEX_CHANGE_KEY.format(version, number)
+                    for number in range(self._sequence + 1, sequence + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) < len(keys):
+                self._rebuild(version, sequence)
+                return self._table
+            self._apply({
+                recipe for recipe_ids in changes.values()
+                for recipe in recipe_ids})
+            self._sequence = sequence
+            return self._table
+
+    def rank(self, ingredients, max_missing=None):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Элементы результата -- кортежи (id рецепта, есть ингредиентов,
+        всего ингредиентов) по убыванию доли имеющихся ингредиентов,
+        затем по возрастанию числа недостающих, по убыванию числа
+        имеющихся и от новых рецептов к старым.
+        """
+        return self._sync().rank(ingredients, max_missing)
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,175 @@
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.dispatch import Signal
+from users.models import Subscription
+
+from . import shopping_list
+from .counters import change_counter
+from .models import Favorite, ShoppingCart
+
+User = get_user_model()
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+# Связи добавляются и удаляются запросами в обход ORM, поэтому
+# вместо post_save и post_delete моделей отправляется этот сигнал.
+relations_changed = Signal()
+
+
+def insert_ignoring_conflicts(model, rows, returning):
+    """Вставляет строки одним запросом, пропуская уже существующие.
+
+    Строки, нарушающие ограничения уникальности, не вставляются
+    (ON CONFLICT DO NOTHING). Возвращает значения поля returning
+    у действительно вставленных строк.
+    """
+    if not rows:
+        return []
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    names = list(rows[0])
+    columns = ', '.join(
+        quote(model._meta.get_field(name).column) for name in names)
+    row_sql = f'({", ".join(["%s"] * len(names))})'
+    sql = (
+        f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+        f'VALUES {", ".join([row_sql] * len(rows))} '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(model._meta.get_field(returning).column)}')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [row[name] for row in rows for name in names])
+        return [value for value, in cursor.fetchall()]
+
+
+def delete_returning(model, conditions, returning):
+    """Удаляет строки одним запросом без сигналов моделей.
+
+    conditions -- словарь {поле: список значений}. Возвращает значения
+    поля returning у действительно удаленных строк.
+    """
+    if not all(conditions.values()):
+        return []
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    where = ' AND '.join(
+        f'{quote(model._meta.get_field(name).column)} '
+        f'IN ({", ".join(["%s"] * len(values))})'
+        for name, values in conditions.items())
+    sql = (
+        f'DELETE FROM {quote(model._meta.db_table)} WHERE {where} '
+        f'RETURNING {quote(model._meta.get_field(returning).column)}')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql, [value for values in conditions.values()
+                  for value in values])
+        return [value for value, in cursor.fetchall()]
+
+
+class UserRelation:
+    """Связи пользователя с рецептами или авторами.
+
+    Добавляет и удаляет сразу список id за постоянное число запросов
+    и возвращает результат для каждого id. Счетчики на связанных
+    объектах меняются только для действительно добавленных или
+    удаленных связей. Связи, созданные и удаленные через ORM (админка,
+    каскадное удаление), учитывают сигналы recipes.signals.
+    """
+
+    def __init__(self, model, target, counter):
+        self.model = model
+        self.field = f'{target}_id'
+        self.target_model = model._meta.get_field(target).related_model
+        self.counter = counter
+
+    def rejected(self, user_id, ids):
+        return {}
+
+    def added(self, user_id, ids):
+        pass
+
+    def removed(self, user_id, ids):
+        pass
+
+    def existing(self, ids):
+        return set(self.target_model.objects.filter(
+            pk__in=ids).values_list('pk', flat=True))
+
+    @transaction.atomic
+    def add(self, user_id, ids):
+        ids = list(dict.fromkeys(ids))
+        found = self.existing(ids)
+        results = {pk: NOT_FOUND for pk in ids if pk not in found}
+        results.update(self.rejected(user_id, found))
+        candidates = [pk for pk in ids if pk not in results]
+        inserted = set(insert_ignoring_conflicts(
+            self.model,
+            [{'user_id': user_id, self.field: pk} for pk in candidates],
+            returning=self.field))
+        for pk in candidates:
+            results[pk] = ADDED if pk in inserted else EXISTS
+        if inserted:
+            self.after_insert(user_id, inserted)
+        return {pk: results[pk] for pk in ids}
+
+    @transaction.atomic
+    def add_one(self, user_id, pk):
+        """Добавляет связь с существующим объектом.
+
+        Возвращает False, если такая связь уже есть. Проверка и вставка
+        выполняются одним запросом, поэтому одновременные запросы не
+        приводят к ошибке целостности.
+        """
+        if not insert_ignoring_conflicts(
+                self.model, [{'user_id': user_id, self.field: pk}],
+                returning=self.field):
+            return False
+        self.after_insert(user_id, {pk})
+        return True
+
+    def after_insert(self, user_id, ids):
+        change_counter(self.target_model.objects.filter(
+            pk__in=ids), self.counter, 1)
+        self.added(user_id, ids)
+        relations_changed.send(sender=self.model, user_id=user_id)
+
+    @transaction.atomic
+    def remove(self, user_id, ids):
+        ids = list(dict.fromkeys(ids))
+        found = self.existing(ids)
+        removed = set(delete_returning(
+            self.model, {'user_id': [user_id], self.field: list(found)},
+            returning=self.field))
+        if removed:
+            change_counter(self.target_model.objects.filter(
+                pk__in=removed), self.counter, -1)
+            self.removed(user_id, removed)
+            relations_changed.send(sender=self.model, user_id=user_id)
+        return {
+            pk: (NOT_FOUND if pk not in found
+                 else REMOVED if pk in removed else MISSING)
+            for pk in ids}
+
+
+class ShoppingCartRelation(UserRelation):
+
+    def added(self, user_id, ids):
+        shopping_list.add_recipes(user_id, ids)
+
+    def removed(self, user_id, ids):
+        shopping_list.remove_recipes(user_id, ids)
+
+
+class SubscriptionRelation(UserRelation):
+
+    def rejected(self, user_id, ids):
+        return {user_id: SELF} if user_id in ids else {}
+
+
+favorites = UserRelation(Favorite, 'recipe', 'favorites_count')
+shopping_cart = ShoppingCartRelation(ShoppingCart, 'recipe', 'in_carts_count')
+subscriptions = SubscriptionRelation(Subscription, 'author', 'followers_count')
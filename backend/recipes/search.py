@@ -0,0 +1,162 @@
+import json
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from foodgram.constants import (INGREDIENT_FUZZY_THRESHOLD,
+                                INGREDIENT_SEARCH_LIMIT)
+
+from .models import Ingredient
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient_index_version'
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е')
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def invalidate_ingredient_index():
+    cache.set(INGREDIENT_INDEX_VERSION_KEY, uuid4().hex, None)
+
+
+def _starting_with(keys, values, prefix):
+    position = bisect_left(keys, prefix)
+    while position < len(keys) and keys[position].startswith(prefix):
+        yield values[position]
+        position += 1
+
+
+class IngredientTable:
+    """Неизменяемый снимок таблицы ингредиентов с поисковыми структурами.
+
+    Хранит отсортированные названия для поиска по префиксу, суффиксы
+    с начала каждого слова и триграммы для поиска по подстроке и
+    поиска с опечатками. Поиск с опечатками выполняется, только если
+    точные совпадения не заполнили выдачу.
+    """
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda row: (normalize(row['name']),
+                                             row['id']))
+        self.rows = rows
+        self.keys = [normalize(row['name']) for row in rows]
+        self.chunks = [
+            json.dumps(row, ensure_ascii=False).encode() for row in rows]
+        words = sorted(
+            (key[match.start():], index)
+            for index, key in enumerate(self.keys)
+            for match in re.finditer(r'\b\w', key) if match.start())
+        self.word_keys = [key for key, _ in words]
+        self.word_rows = [index for _, index in words]
+        self.grams = [trigrams(key) for key in self.keys]
+        postings = defaultdict(list)
+        for index, grams in enumerate(self.grams):
+            for gram in grams:
+                postings[gram].append(index)
+        self.postings = dict(postings)
+
+    def prefix(self, query):
+        return list(_starting_with(self.keys, range(len(self.keys)), query))
+
+    def word_start(self, query):
+        return _starting_with(self.word_keys, self.word_rows, query)
+
+    def substring(self, query):
+        inner = [query[i:i + 3] for i in range(len(query) - 2)]
+        if not inner:
+            return
+        postings = sorted((self.postings.get(gram, ()) for gram in inner),
+                          key=len)
+        for index in sorted(set(postings[0]).intersection(*postings[1:])):
+            if query in self.keys[index]:
+                yield index
+
+    def fuzzy(self, query, threshold):
+        grams = trigrams(query)
+        shared = Counter(
+            index for gram in grams for index in self.postings.get(gram, ()))
+        scored = []
+        for index, common in shared.items():
+            similarity = common / (
+                len(grams) + len(self.grams[index]) - common)
+            if similarity >= threshold:
+                scored.append((-similarity, index))
+        return [index for _, index in sorted(scored)]
+
+    def ranked(self, query, limit, threshold):
+        prefix = self.prefix(query)
+        found = prefix[:limit]
+        seen = set(prefix)
+        for tier in (self.word_start(query), self.substring(query)):
+            self._take(tier, limit, found, seen)
+        if len(found) < limit:
+            self._take(self.fuzzy(query, threshold), limit, found, seen)
+        return found
+
+    @staticmethod
+    def _take(tier, limit, found, seen):
+        taken = 0
+        for index in tier:
+            if taken == limit:
+                break
+            if index not in seen:
+                seen.add(index)
+                found.append(index)
+                taken += 1
+
+    def to_json(self, indexes):
+        return b'[' + b','.join(self.chunks[index] for index in indexes) + b']'
+
+
+class IngredientIndex:
+    """Поисковый индекс ингредиентов в памяти процесса.
+
+    Версия индекса хранится в кэше Django, поэтому изменение ингредиентов
+    в одном процессе приводит к перестроению индекса во всех остальных.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._table = None
+
+    def _get_table(self):
+        version = cache.get_or_set(
+            INGREDIENT_INDEX_VERSION_KEY, uuid4().hex, None)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._table = IngredientTable(Ingredient.objects.values(
+                        'id', 'name', 'measurement_unit'))
+                    self._version = version
+        return self._table
+
+    def search(self, prefix=''):
+        table = self._get_table()
+        return [table.rows[index] for index in table.prefix(normalize(prefix))]
+
+    def search_json(self, prefix=''):
+        table = self._get_table()
+        return table.to_json(table.prefix(normalize(prefix)))
+
+    def ranked(self, query, limit=INGREDIENT_SEARCH_LIMIT,
+               threshold=INGREDIENT_FUZZY_THRESHOLD):
+        table = self._get_table()
+        return [table.rows[index] for index in
+                table.ranked(normalize(query), limit, threshold)]
+
+    def ranked_json(self, query, limit=INGREDIENT_SEARCH_LIMIT,
+                    threshold=INGREDIENT_FUZZY_THRESHOLD):
+        table = self._get_table()
+        return table.to_json(table.ranked(normalize(query), limit, threshold))
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connections, router, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+
+def add_amounts(rows):
+    """Прибавляет количества к спискам покупок одним запросом.
+
+    rows -- кортежи (id пользователя, id ингредиента, количество).
+    Отсутствующие строки вставляются, к существующим количество
+    прибавляется (ON CONFLICT DO UPDATE), поэтому одновременные
+    добавления одного ингредиента не нарушают уникальность.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(ShoppingListItem)]
+    quote = connection.ops.quote_name
+    table = quote(ShoppingListItem._meta.db_table)
+    user, ingredient, amount = (
+        quote(ShoppingListItem._meta.get_field(name).column)
+        for name in ('user', 'ingredient', 'amount'))
+    sql = (
+        f'INSERT INTO {table} ({user}, {ingredient}, {amount}) '
+        f'VALUES {", ".join(["(%s, %s, %s)"] * len(rows))} '
+        f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+        f'SET {amount} = {table}.{amount} + EXCLUDED.{amount}')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def apply_deltas(user_ids, deltas):
+    """Прибавляет к спискам покупок пользователей изменения количеств.
+
+    deltas -- словарь {id ингредиента: изменение количества}.
+    Положительные изменения вставляются или прибавляются одним
+    запросом, отрицательные уменьшают существующие строки, а строки
+    с нулевым количеством удаляются.
+    """
+    deltas = {ingredient: delta for ingredient, delta in deltas.items()
+              if delta}
+    user_ids = list(user_ids)
+    if not deltas or not user_ids:
+        return
+    decreases = {ingredient: delta for ingredient, delta in deltas.items()
+                 if delta < 0}
+    with transaction.atomic():
+        if decreases:
+            items = ShoppingListItem.objects.filter(
+                user_id__in=user_ids, ingredient_id__in=decreases)
+            items.update(amount=F('amount') + Case(
+                *[When(ingredient_id=ingredient, then=Value(delta))
+                  for ingredient, delta in decreases.items()],
+                output_field=IntegerField()))
+            items.filter(amount__lte=0).delete()
+        add_amounts([
+            (user, ingredient, delta)
+            for user in user_ids
+            for ingredient, delta in deltas.items()
+            if delta > 0])
+
+
+def recipe_amounts(recipe_id):
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+
+def recipes_amounts(recipe_ids):
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by().values('ingredient_id').annotate(
+        total=Sum('amount')).values_list('ingredient_id', 'total'))
+
+
+def add_recipe(user_ids, recipe_id):
+    apply_deltas(user_ids, recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_ids, recipe_id):
+    apply_deltas(user_ids, {
+        ingredient: -amount
+        for ingredient, amount in recipe_amounts(recipe_id).items()})
+
+
+def add_recipes(user_id, recipe_ids):
+    apply_deltas((user_id,), recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    apply_deltas((user_id,), {
+        ingredient: -amount
+        for ingredient, amount in recipes_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    deltas = {
+        ingredient: new_amounts.get(ingredient, 0)
+        - old_amounts.get(ingredient, 0)
+        for ingredient in old_amounts.keys() | new_amounts.keys()}
+    apply_deltas(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id).values_list('user_id', flat=True),
+        deltas)
+
+
+@contextmanager
+def tracking_recipes(recipe_ids):
+    """Переносит в списки покупок правки ингредиентов рецептов,
+    сделанные внутри блока в обход RecipeWriteSerializer."""
+    old = {recipe_id: recipe_amounts(recipe_id) for recipe_id in recipe_ids
+           if recipe_id is not None}
+    yield
+    for recipe_id, amounts in old.items():
+        change_recipe(recipe_id, amounts, recipe_amounts(recipe_id))
+
+
+def expected_totals():
+    totals = defaultdict(dict)
+    rows = ShoppingCart.objects.filter(
+        recipe__recipeingredients__isnull=False
+    ).values(
+        'user', 'recipe__recipeingredients__ingredient'
+    ).annotate(amount=Sum('recipe__recipeingredients__amount'))
+    for row in rows.iterator():
+        totals[row['user']][
+            row['recipe__recipeingredients__ingredient']] = row['amount']
+    return totals
+
+
+def actual_totals():
+    totals = defaultdict(dict)
+    for user, ingredient, amount in ShoppingListItem.objects.order_by(
+    ).values_list('user_id', 'ingredient_id', 'amount').iterator():
+        totals[user][ingredient] = amount
+    return totals
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from users.models import Subscription
+
+from . import shopping_list
+from .counters import count_changed
+from .fulltext import index_recipes, unindex_recipes
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Tag)
+from .pantry import invalidate_pantry_index, record_recipe_changes
+from .search import invalidate_ingredient_index
+from .tags import invalidate_tags
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    transaction.on_commit(invalidate_ingredient_index)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    transaction.on_commit(invalidate_tags)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, raw=False, using=None, **kwargs):
+    # Новый рецепт индексируется после добавления ингредиентов:
+    # в RecipeWriteSerializer.create и RecipeAdmin.save_related.
+    if not created and not raw:
+        index_recipes((instance.pk,), using)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, using=None, **kwargs):
+    unindex_recipes((instance.pk,), using)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(instance, created, raw=False, using=None, **kwargs):
+    if not created and not raw:
+        index_recipes(RecipeIngredient.objects.using(using).filter(
+            ingredient=instance).values_list('recipe_id', flat=True), using)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    recipe_ids = (instance.pk,)
+    transaction.on_commit(lambda: record_recipe_changes(recipe_ids))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(instance, **kwargs):
+    transaction.on_commit(
+        lambda: record_recipe_changes((instance.recipe_id,)))
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(**kwargs):
+    transaction.on_commit(invalidate_pantry_index)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def counted_created(sender, instance, created, raw=False, **kwargs):
+    # Массовые добавления и удаления из recipes.relations идут в обход
+    # ORM и меняют счетчики сами.
+    if created and not raw:
+        count_changed(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def counted_deleted(sender, instance, **kwargs):
+    count_changed(sender, instance, -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_created(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        shopping_list.add_recipe((instance.user_id,), instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def cart_deleting(instance, **kwargs):
+    # До удаления: при каскадном удалении рецепта его ингредиенты
+    # еще на месте.
+    shopping_list.remove_recipe((instance.user_id,), instance.recipe_id)
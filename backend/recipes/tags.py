@@ -0,0 +1,22 @@
+from django.core.cache import cache
+
+from .models import Tag
+
+TAG_SLUGS_CACHE_KEY = 'tag_slugs'
+
+
+def tag_ids_by_slug():
+    """Словарь {slug: id} всех тегов; хранится в кэше до изменения тегов."""
+    tags = cache.get(TAG_SLUGS_CACHE_KEY)
+    if tags is None:
+        tags = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(TAG_SLUGS_CACHE_KEY, tags, None)
+    return tags
+
+
+def tag_choices():
+    return [(slug, slug) for slug in sorted(tag_ids_by_slug())]
+
+
+def invalidate_tags():
+    cache.delete(TAG_SLUGS_CACHE_KEY)
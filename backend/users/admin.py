@@ -1,22 +1,27 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from recipes.admin import AuthorFilter, LargeTableMixin, RelationAdminMixin
 
 from .models import Subscription, User
 
 
 @admin.register(User)
-class UserAdmin(UserAdmin):
+class UserAdmin(LargeTableMixin, UserAdmin):
     list_display = (
         'username',
         'id',
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
+        'followers_count',
     )
-    list_filter = ('email', 'first_name')
+    search_fields = ('^username', '^email', 'first_name', 'last_name')
 
 
 @admin.register(Subscription)
-class SubscribeAdmin(admin.ModelAdmin):
+class SubscribeAdmin(RelationAdminMixin, LargeTableMixin, admin.ModelAdmin):
     list_display = ('user', 'author',)
-    list_filter = ('author',)
+    list_filter = (AuthorFilter,)
+    list_select_related = ('user', 'author')
+    raw_id_fields = ('user', 'author')
@@ -22,6 +22,14 @@ class User(AbstractUser):
         unique=True,
         validators=(UnicodeUsernameValidator(),),
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False)
 
     class Meta:
         ordering = ('email',)
@@ -51,6 +59,8 @@ class Subscription(models.Model):
             fields=['user', 'author'],
             name='unique_subscription'
         )]
+        indexes = [models.Index(fields=['author', 'user'],
+                                name='subscription_author_user_idx')]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 